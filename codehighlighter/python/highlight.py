@@ -64,30 +64,39 @@ try:
     # python standard
     import re
     import traceback
+    from contextlib import contextmanager
+    from hashlib import blake2b
     from math import log10
     from ast import literal_eval
 
     # pygments
     import pygments
-    from pygments.lexers import get_all_lexers, get_lexer_by_name, guess_lexer
-    from pygments.styles import get_all_styles, get_style_by_name
+    from pygments.lexers import find_lexer_class_by_name
+    from pygments.styles import get_style_by_name
+    from pygments.token import string_to_tokentype
+    from ch2.catalog import load_catalog
+    from ch2.detect import DetectionMemo
+    from ch2.lexerpool import pool as lexerpool
+    from ch2.plan import build_plan, locate, utf16_len
+    from ch2.styletable import get_table
     logger.info(f"Pygments located in {pygments.__path__}.")
     logger.info(f"Lexers imported from {pygments.lexers.__file__}.")
 
     # uno
     import unohelper
-    from com.sun.star.awt import Selection, XDialogEventHandler
+    from com.sun.star.awt import Selection, XCallback, XDialogEventHandler
     from com.sun.star.awt.FontWeight import NORMAL as W_NORMAL, BOLD as W_BOLD
     from com.sun.star.awt.FontSlant import NONE as SL_NONE, ITALIC as SL_ITALIC
     from com.sun.star.awt.FontUnderline import NONE as UL_NONE, SINGLE as UL_SINGLE
     from com.sun.star.awt.MessageBoxType import ERRORBOX, INFOBOX
     from com.sun.star.beans import PropertyValue
     from com.sun.star.container import ElementExistException
-    from com.sun.star.document import XUndoAction
+    from com.sun.star.document import XDocumentEventListener, XUndoAction
     from com.sun.star.drawing.FillStyle import SOLID as FS_SOLID  # , NONE as FS_NONE
     from com.sun.star.lang import Locale
     from com.sun.star.sheet.CellFlags import STRING as CF_STRING
     from com.sun.star.task import XJobExecutor
+    from com.sun.star.util import XChangesListener, XModifyListener
     from com.sun.star.xml import AttributeData
 
 except Exception:
@@ -97,8 +106,41 @@ except Exception:
 
 CHARSTYLEID = "ch2_"
 SNIPPETTAGID = CHARSTYLEID + "options"
+# snippet tag: "<format>:<snippet ID>:<options set ID>:<options set checksum>:<snippet hash>",
+# format 1 is the options repr
+TAGFORMAT = 4
+REGISTRYPROP = CHARSTYLEID + "snippets"    # user defined document property, see SnippetRegistry
+SNIPPETBOOKMARK = re.compile(CHARSTYLEID + r"\d+")     # names of snippet bookmarks (and their copies) and shapes
 INVALID_SELECTION = "Invalid"
 SELECTED_PARASTYLE = {}
+SERVICE = None  # process-wide HighlighterService, see get_service()
+PARASTYLES = {}     # document RuntimeUID -> (style names, {display name: name}) of paragraph styles
+UNOPROPS = {}   # property tuple -> (UNO property names, UNO values)
+DETECTIONS = {}     # document RuntimeUID -> DetectionMemo
+DOCUMENT_WATCHERS = {}      # document RuntimeUID -> DocumentWatcher
+
+
+class BlockSnapshot:
+    '''
+    Text of a code block, read once across the UNO bridge and shared by all
+    highlighting phases. Call refresh() after any operation changing the text,
+    like line numbering removal.
+    '''
+
+    def __init__(self, textrange, code=None):
+        self.textrange = textrange
+        self._code = code
+
+    @property
+    def code(self):
+        if self._code is None:
+            self._code = self.textrange.String
+        return self._code
+
+    def refresh(self, textrange=None):
+        if textrange is not None:
+            self.textrange = textrange
+        self._code = None
 
 
 class UndoAction(unohelper.Base, XUndoAction):
@@ -107,7 +149,7 @@ class UndoAction(unohelper.Base, XUndoAction):
     i.e. when applied on textbox objects.
     '''
 
-    def __init__(self, doc, textbox, title):
+    def __init__(self, doc, textbox, title, text=None):
         self.doc = doc
         self.textbox = textbox
         self.old_portions = None
@@ -117,17 +159,10 @@ class UndoAction(unohelper.Base, XUndoAction):
         self.charprops = ("CharBackColor", "CharColor", "CharLocale", "CharPosture",
                           "CharHeight", "CharUnderline", "CharWeight")
         self.bgprops = ("FillColor", "FillStyle")
-        self.len_ = self.define_len()
-        self.get_old_state()
+        self.get_old_state(text)
         # XUndoAction attribute
         self.Title = title
 
-    def define_len(self):
-        # workaround for issue 22 (https://github.com/jmzambon/libreoffice-code-highlighter/issues/22)
-        if any(ord(char) >= 0x10000 for char in self.textbox.String):
-            return lambda s: sum(1 if ord(char) < 0x10000 else 2 for char in s)
-        return len
-
     # XUndoAction (https://www.openoffice.org/api/docs/common/ref/com/sun/star/document/XUndoAction.html)
     def undo(self):
         self.textbox.setString(self.old_text)
@@ -140,14 +175,15 @@ class UndoAction(unohelper.Base, XUndoAction):
         self._format(self.new_portions, self.new_bg)
 
     # public
-    def get_old_state(self):
+    def get_old_state(self, text=None):
         '''
         Gather text formattings before code highlighting.
         Will be used by <undo> to restore old state.
+        text: current text of the textbox, if already known
         '''
 
         self.old_bg = self.textbox.getPropertyValues(self.bgprops)
-        self.old_text = self.textbox.String
+        self.old_text = self.textbox.String if text is None else text
         self.old_portions = self._extract_portions()
         self.old_attributes = self.textbox.UserDefinedAttributes
 
@@ -169,7 +205,8 @@ class UndoAction(unohelper.Base, XUndoAction):
             if textportions:    # new paragraph after first one
                 textportions[-1][0] += 1
             for portion in para:
-                plen = self.len_(portion.String)
+                # workaround for issue 22 (https://github.com/jmzambon/libreoffice-code-highlighter/issues/22)
+                plen = utf16_len(portion.String)
                 pprops = portion.getPropertyValues(self.charprops)
                 if textportions and textportions[-1][1] == pprops:
                     textportions[-1][0] += plen
@@ -189,6 +226,520 @@ class UndoAction(unohelper.Base, XUndoAction):
         self.doc.setModified(True)
 
 
+class HighlighterService(unohelper.Base, XChangesListener, XModifyListener):
+    '''
+    Process-wide resources shared by all CodeHighlighter instances:
+    registry access and options, extension infos, translations and dispatcher.
+    Options are reloaded when the registry changes, extension infos and
+    translations when the extension manager reports a modification.
+    '''
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.sm = ctx.ServiceManager
+        self.dispatcher = self.sm.createInstance("com.sun.star.frame.DispatchHelper")
+        self.cfg_access = self.create_cfg_access()
+        self.options = self.load_options()
+        self.setlogger()
+        self.extpath, self.extver = self.getextinfos()
+        self.installgettext()
+        self._catalog = None
+        self.cfg_access.addChangesListener(self)
+        try:
+            extmanager = ctx.getByName("/singletons/com.sun.star.deployment.ExtensionManager")
+            extmanager.addModifyListener(self)
+        except Exception:
+            logger.exception("Extension manager listener could not be added.")
+        logger.debug("Highlighter service started.")
+
+    # XChangesListener (https://api.libreoffice.org/docs/idl/ref/interfacecom_1_1sun_1_1star_1_1util_1_1XChangesListener.html)
+    def changesOccurred(self, event):
+        self.options = self.load_options()
+        self.setlogger()
+        logger.debug("Options reloaded after registry change.")
+
+    # XModifyListener (https://api.libreoffice.org/docs/idl/ref/interfacecom_1_1sun_1_1star_1_1util_1_1XModifyListener.html)
+    def modified(self, event):
+        self.extpath, self.extver = self.getextinfos()
+        self.installgettext()
+        self._catalog = None
+        logger.debug("Extension infos reloaded after extension update.")
+
+    # XEventListener
+    def disposing(self, source):
+        global SERVICE
+        if SERVICE is self:
+            SERVICE = None
+
+    @property
+    def catalog(self):
+        '''Lexer and style catalog, cached on disk in the user profile.'''
+
+        if self._catalog is None:
+            try:
+                userpath = self.sm.createInstance("com.sun.star.util.PathSubstitution").substituteVariables("$(user)", True)
+                cachedir = uno.fileUrlToSystemPath(userpath)
+            except Exception:
+                logger.exception("User profile path not available, lexer catalog will not be cached.")
+                cachedir = None
+            self._catalog = load_catalog(cachedir, self.extver)
+        return self._catalog
+
+    def create_cfg_access(self):
+        '''Return an updatable instance of the codehighlighter node in LO registry. '''
+
+        cfg = self.sm.createInstance('com.sun.star.configuration.ConfigurationProvider')
+        prop = PropertyValue('nodepath', 0, '/ooo.ext.code-highlighter.Registry/Settings', 0)
+        cfg_access = cfg.createInstanceWithArguments('com.sun.star.configuration.ConfigurationUpdateAccess', (prop,))
+        return cfg_access
+
+    def load_options(self):
+        properties = self.cfg_access.ElementNames
+        values = self.cfg_access.getPropertyValues(properties)
+        return dict(zip(properties, values))
+
+    def save_options(self, choices):
+        self.options.update(choices)
+        self.cfg_access.setPropertyValues(tuple(choices.keys()), tuple(choices.values()))
+        self.cfg_access.commitChanges()
+
+    def setlogger(self):
+        loglevel = LOGLEVEL.get(self.options["LogLevel"], 0)
+        logger.setLevel(loglevel)
+        if self.options["LogToFile"] == 0:
+            for h in logger.handlers:
+                if isinstance(h, logging.FileHandler):
+                    logger.removeHandler(h)
+                    return
+        else:
+            for h in logger.handlers:
+                if isinstance(h, logging.FileHandler):
+                    return
+            logger.addHandler(filehandler)
+
+    def getextinfos(self):
+        pip = self.ctx.getByName("/singletons/com.sun.star.deployment.PackageInformationProvider")
+        extensions = pip.getExtensionList()
+        extid = "javahelps.codehighlighter"
+        extpath = pip.getPackageLocation(extid)
+        extver = ""
+        for e in extensions:
+            if extid in e:
+                extver = e[1]
+        return extpath, extver
+
+    def installgettext(self):
+        locdir = os.path.join(uno.fileUrlToSystemPath(self.extpath), "locales")
+        logger.debug(f'Locales folder: {locdir}')
+        # ps = self.create("com.sun.star.util.PathSubstitution")
+        # vlang = ps.getSubstituteVariableValue("vlang")
+        # lang = vlang.split("-")[0]
+        # gtlang = gettext.translation('ch2', localedir=locdir, languages=[lang], fallback=True)
+        gtlang = gettext.translation('ch2', localedir=locdir, fallback=True)
+        gtlang.install(names=['_', 'ngettext'])
+
+
+class DocumentWatcher(unohelper.Base, XDocumentEventListener):
+    '''Release every per-document resource when a document of any type is closed.'''
+
+    def __init__(self, doc):
+        self.uid = doc.RuntimeUID
+        doc.addDocumentEventListener(self)
+
+    def release(self):
+        for resources in (PARASTYLES, DETECTIONS, SELECTED_PARASTYLE, DOCUMENT_WATCHERS):
+            resources.pop(self.uid, None)
+
+    # XDocumentEventListener
+    def documentEventOccured(self, event):
+        if event.EventName == "OnUnload":
+            self.release()
+
+    # XEventListener
+    def disposing(self, source):
+        self.release()
+
+
+class ParaStylesFiller(unohelper.Base, XCallback):
+    '''
+    Populate the paragraph styles of the options dialog from the main thread,
+    once the dialog is displayed. Call cancel() when the dialog is closed.
+    '''
+
+    def __init__(self, highlighter, dialog):
+        self.highlighter = highlighter
+        self.dialog = dialog
+
+    def cancel(self):
+        self.dialog = None
+
+    # XCallback
+    def notify(self, data):
+        dialog, self.dialog = self.dialog, None
+        if dialog is not None:
+            self.highlighter.fill_parastyles(dialog)
+
+
+class SnippetRegistry:
+    '''
+    Registry of the tagged snippets of a document, stored as a user defined document property,
+    so that bulk operations go straight to the snippets instead of browsing the whole document.
+
+    Each snippet ID (also stored in the snippet tags) maps to an anchor:
+        ('bookmark', name)          text snippet, spanned by bookmark ch2_<ID>
+        ('frame', name)             Writer text frame
+        ('cell', table, cellname)   Writer text table cell
+        ('shape', name)             text shape, named ch2_<ID> by the registry if it had no name
+        ('calc', absolutename)      Calc cell or cell ranges
+    Entries are validated lazily, when resolved: a missing snippet is unregistered,
+    and the registry is not complete anymore, as the snippet may have been moved.
+    complete: every tagged snippet of the document was registered when the document was last browsed
+    census: document counts taken then, see takecensus()
+
+    The snippet tags refer to the options they were highlighted with through
+    the options sets table, which holds each distinct set once.
+    '''
+
+    FORMAT = 1
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.snippets = {}
+        self.optionsets = {}
+        self.complete = False
+        self.census = None
+        self.dirty = False
+        try:
+            data = literal_eval(self.properties.getPropertyValue(REGISTRYPROP))
+            if data.get('format') == self.FORMAT:
+                self.snippets = data['snippets']
+                self.complete = data['complete']
+                self.optionsets = data.get('optionsets', {})
+                self.census = data.get('census')
+        except Exception:
+            # no registry yet, or unreadable one
+            pass
+
+    @property
+    def properties(self):
+        return self.doc.DocumentProperties.UserDefinedProperties
+
+    def save(self):
+        if not self.dirty:
+            return
+        value = repr({'format': self.FORMAT, 'complete': self.complete, 'snippets': self.snippets,
+                      'optionsets': self.optionsets, 'census': self.census})
+        properties = self.properties
+        if properties.PropertySetInfo.hasPropertyByName(REGISTRYPROP):
+            properties.setPropertyValue(REGISTRYPROP, value)
+        else:
+            properties.addProperty(REGISTRYPROP, 0, value)
+        self.dirty = False
+        logger.debug(f"Snippet registry saved ({len(self.snippets)} snippets).")
+
+    def clear(self):
+        '''
+        Unregister all snippets, removing the snippet bookmarks and the names given to shapes by the registry.
+        The options sets table is kept: document properties are not restored by undo, unlike the tags
+        referring to it.
+        '''
+
+        try:
+            bookmarks = self.doc.Bookmarks
+            for name in bookmarks.ElementNames:
+                if SNIPPETBOOKMARK.match(name):
+                    bookmark = bookmarks.getByName(name)
+                    bookmark.Anchor.Text.removeTextContent(bookmark)
+        except AttributeError:
+            # no bookmarks outside of Writer
+            pass
+        for drawpage in self.drawpages():
+            for shape in drawpage:
+                if SNIPPETBOOKMARK.fullmatch(shape.Name):
+                    shape.Name = ""
+        self.snippets = {}
+        self.complete = False
+        self.census = None
+        if self.optionsets:
+            self.dirty = True
+            self.save()
+        else:
+            properties = self.properties
+            if properties.PropertySetInfo.hasPropertyByName(REGISTRYPROP):
+                properties.removeProperty(REGISTRYPROP)
+            self.dirty = False
+
+    def takecensus(self):
+        '''
+        Return cheap document counts that change when snippets are copied (frames, tables,
+        shapes per draw page), or None when copies can not be noticed, like in Calc.
+        '''
+
+        try:
+            if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
+                return (self.doc.TextFrames.Count, self.doc.TextTables.Count, self.doc.DrawPage.Count)
+            if self.doc.supportsService('com.sun.star.drawing.GenericDrawingDocument'):
+                return tuple(drawpage.Count for drawpage in self.doc.DrawPages)
+        except Exception:
+            logger.exception("Document census failed.")
+        return None
+
+    def markcomplete(self):
+        '''Record that every tagged snippet of the document is registered.'''
+
+        self.complete = True
+        self.census = self.takecensus()
+        self.dirty = True
+
+    def trusted(self):
+        '''
+        Check that the registry is complete and that no snippet can have been copied since:
+        copies keep the snippet ID of their original, so they are never resolved.
+        '''
+
+        if not self.complete or self.census is None or self.takecensus() != self.census:
+            return False
+        try:
+            # text copies come with a renamed copy of the snippet bookmark
+            bookmarks = sum(1 for name in self.doc.Bookmarks.ElementNames if SNIPPETBOOKMARK.match(name))
+        except AttributeError:
+            bookmarks = 0
+        return bookmarks == sum(1 for anchor in self.snippets.values() if anchor[0] == 'bookmark')
+
+    def newid(self):
+        return max(self.snippets, default=0) + 1
+
+    @staticmethod
+    def checksum(options):
+        '''Return the checksum of an options set, stored in snippet tags along with its document-local ID.'''
+
+        return blake2b(repr(sorted(options.items())).encode('utf-8'), digest_size=4).hexdigest()
+
+    def optionsid(self, options):
+        '''Return the ID of an options set, adding it to the table if needed.'''
+
+        for optionsid, optionset in self.optionsets.items():
+            if optionset == options:
+                return optionsid
+        optionsid = max(self.optionsets, default=0) + 1
+        self.optionsets[optionsid] = dict(options)
+        self.dirty = True
+        return optionsid
+
+    def register(self, snippetid, code_block, inline=False):
+        '''Anchor code_block in the document and register it under snippetid.'''
+
+        anchor = self.makeanchor(snippetid, code_block, inline)
+        if anchor is not None and self.snippets.get(snippetid) != anchor:
+            self.snippets[snippetid] = anchor
+            self.dirty = True
+
+    def unregister(self, snippetid):
+        anchor = self.snippets.pop(snippetid, None)
+        self.dirty = True
+        if anchor and anchor[0] == 'bookmark':
+            self.removebookmark(anchor[1])
+
+    def owns(self, snippetid, code_block):
+        '''Check that snippetid is registered at the place of code_block (and not copied from elsewhere).'''
+
+        anchor = self.snippets.get(snippetid)
+        if anchor is None:
+            return False
+        if anchor[0] != 'bookmark':
+            return anchor == self.anchorof(code_block)
+        registered = self.resolve(anchor)
+        return registered is not None and self.overlaps(registered, code_block)
+
+    def bookmarkedrange(self, snippetid, textrange):
+        '''Return a cursor over the bookmark of snippet snippetid if it overlaps textrange, otherwise None.'''
+
+        registered = self.resolve(('bookmark', f"{CHARSTYLEID}{snippetid}"))
+        if registered is not None and self.overlaps(registered, textrange):
+            return registered
+        return None
+
+    @staticmethod
+    def overlaps(range1, range2):
+        try:
+            text = range1.Text
+            return (text == range2.Text
+                    and text.compareRegionStarts(range1, range2.End) >= 0
+                    and text.compareRegionStarts(range2, range1.End) >= 0)
+        except Exception:
+            return False
+
+    def anchorof(self, code_block):
+        '''Return the anchor of a code block which is a document object, or None.'''
+
+        impl = code_block.ImplementationName
+        if impl == "SwXTextFrame":
+            return ('frame', code_block.Name)
+        if impl == "SwXCell":
+            return ('cell', code_block.createTextCursor().TextTable.Name, code_block.CellName)
+        if impl in ("ScCellObj", "ScCellRangeObj"):
+            return ('calc', code_block.AbsoluteName)
+        if impl == "ScCellRangesObj":
+            return ('calc', code_block.RangeAddressesAsString)
+        if impl in ("SwXShape", "SvxShapeText", "com.sun.star.comp.sc.ScShapeObj"):
+            return ('shape', code_block.Name) if code_block.Name else None
+        return None
+
+    def makeanchor(self, snippetid, code_block, inline=False):
+        impl = code_block.ImplementationName
+        if impl in ("SwXTextRange", "SwXTextCursor"):
+            name = f"{CHARSTYLEID}{snippetid}"
+            self.removebookmark(name)
+            c = code_block.Text.createTextCursorByRange(code_block)
+            if not inline:
+                c.collapseToStart()
+                c.gotoStartOfParagraph(False)
+                c.gotoRange(code_block.End, True)
+                c.gotoEndOfParagraph(True)
+            self.removecopiedbookmarks(c)
+            bookmark = self.doc.createInstance("com.sun.star.text.Bookmark")
+            bookmark.Name = name
+            c.Text.insertTextContent(c, bookmark, True)
+            return ('bookmark', name)
+        if impl in ("SwXShape", "SvxShapeText", "com.sun.star.comp.sc.ScShapeObj") and not code_block.Name:
+            # the name is removed again when the registry is cleared
+            code_block.Name = f"{CHARSTYLEID}{snippetid}"
+        return self.anchorof(code_block)
+
+    def removecopiedbookmarks(self, textrange):
+        '''Remove the unregistered snippet bookmarks over textrange, pasted with the text of a snippet.'''
+
+        bookmarks = self.doc.Bookmarks
+        registered = {anchor[1] for anchor in self.snippets.values() if anchor[0] == 'bookmark'}
+        for name in bookmarks.ElementNames:
+            if SNIPPETBOOKMARK.match(name) and name not in registered:
+                bookmark = bookmarks.getByName(name)
+                if self.overlaps(bookmark.Anchor, textrange):
+                    bookmark.Anchor.Text.removeTextContent(bookmark)
+
+    def removebookmark(self, name):
+        bookmarks = self.doc.Bookmarks
+        if bookmarks.hasByName(name):
+            bookmark = bookmarks.getByName(name)
+            bookmark.Anchor.Text.removeTextContent(bookmark)
+
+    def drawpages(self):
+        if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
+            return [self.doc.DrawPage]
+        if self.doc.supportsService('com.sun.star.sheet.SpreadsheetDocument'):
+            return [sheet.DrawPage for sheet in self.doc.Sheets]
+        return list(self.doc.DrawPages)
+
+    def shapemap(self):
+        '''Return the named shapes of all draw pages, by name.'''
+
+        shapes = {}
+        for drawpage in self.drawpages():
+            for shape in drawpage:
+                if shape.Name:
+                    shapes.setdefault(shape.Name, shape)
+        return shapes
+
+    def resolve(self, anchor, shapes=None):
+        '''
+        Return the code block of an anchor, or None if it does not exist anymore.
+        shapes: shapemap() of the document, when resolving several anchors
+        '''
+
+        kind, name = anchor[:2]
+        try:
+            if kind == 'bookmark':
+                bookmarks = self.doc.Bookmarks
+                if bookmarks.hasByName(name):
+                    textrange = bookmarks.getByName(name).Anchor
+                    return textrange.Text.createTextCursorByRange(textrange)
+            elif kind == 'frame':
+                frames = self.doc.TextFrames
+                if frames.hasByName(name):
+                    return frames.getByName(name)
+            elif kind == 'cell':
+                tables = self.doc.TextTables
+                if tables.hasByName(name):
+                    return tables.getByName(name).getCellByName(anchor[2])
+            elif kind == 'calc':
+                ranges = [r for n in name.split(';') for r in self.doc.Sheets.getCellRangesByName(n)]
+                if len(ranges) == 1:
+                    return ranges[0]
+                cellranges = self.doc.createInstance("com.sun.star.sheet.SheetCellRanges")
+                for r in ranges:
+                    cellranges.addRangeAddress(r.RangeAddress, False)
+                return cellranges
+            elif kind == 'shape':
+                return (self.shapemap() if shapes is None else shapes).get(name)
+        except Exception:
+            logger.debug(f"Snippet anchor {anchor} could not be resolved.")
+        return None
+
+    def entries(self):
+        '''
+        Yield (snippet ID, code block, anchor kind) for every registered snippet
+        still present and tagged in the document. Other entries are dropped.
+        '''
+
+        shapes = None
+        for snippetid, anchor in list(self.snippets.items()):
+            if anchor[0] == 'shape' and shapes is None:
+                shapes = self.shapemap()
+            code_block = self.resolve(anchor, shapes)
+            if code_block is not None:
+                udas, _ = getsnippetudas(code_block)
+                if udas and SNIPPETTAGID in udas and parsetag(udas.getByName(SNIPPETTAGID).Value)[0] == snippetid:
+                    yield snippetid, code_block, anchor[0]
+                    continue
+            logger.debug(f"Snippet {snippetid} not found anymore, unregistered.")
+            self.unregister(snippetid)
+            self.complete = False
+
+
+def parsetag(value):
+    '''
+    Return (snippet ID, options set ID, options set checksum, snippet hash) of a snippet tag value.
+    Legacy tags, holding the options repr, give (None, None, None, None),
+    format 3 tags have no checksum, format 2 tags have no hash either.
+    '''
+
+    fields = value.split(':')
+    try:
+        if len(fields) == 5 and fields[0] == str(TAGFORMAT):
+            return int(fields[1]), int(fields[2]), fields[3], fields[4]
+        if len(fields) == 4 and fields[0] == '3':
+            return int(fields[1]), int(fields[2]), None, fields[3]
+        if len(fields) == 3 and fields[0] == '2':
+            return int(fields[1]), int(fields[2]), None, None
+    except ValueError:
+        pass
+    return None, None, None, None
+
+
+def getsnippetudas(code_block):
+    '''
+    Return (user defined attributes, property name) of the tags of a code block,
+    looking at paragraph attributes first, then at text attributes, for text ranges.
+    '''
+
+    try:
+        return code_block.UserDefinedAttributes, 'UserDefinedAttributes'
+    except AttributeError:
+        udas = code_block.ParaUserDefinedAttributes
+        if udas and SNIPPETTAGID in udas:
+            return udas, 'ParaUserDefinedAttributes'
+        return code_block.TextUserDefinedAttributes, 'TextUserDefinedAttributes'
+
+
+def get_service(ctx):
+    '''Return the process-wide HighlighterService, creating it on first call.'''
+
+    global SERVICE
+    if SERVICE is None:
+        SERVICE = HighlighterService(ctx)
+    return SERVICE
+
+
 class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
     def __init__(self, ctx):
         try:
@@ -201,31 +752,25 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             self.charstylesavailable = (
                     'CharacterStyles' in self.doc.StyleFamilies and
                     self.doc.CurrentSelection.ImplementationName != "com.sun.star.drawing.SvxShapeCollection")
-            self.parastyles = self.loadparastyles()
-            self.cfg_access = self.create_cfg_access()
-            self.options = self.load_options()
-            self.extpath, self.extver = self.getextinfos()
-            self.setlogger()
+            self.service = get_service(ctx)
+            # options can be changed per snippet, so work on a copy
+            self.options = dict(self.service.options)
+            self.extpath, self.extver = self.service.extpath, self.service.extver
             logger.debug(f"Code Highlighter started from {self.doc.Title}.")
             logger.info(f"Loaded options = {self.options}.")
             self.frame = self.doc.CurrentController.Frame
-            self.dispatcher = self.create("com.sun.star.frame.DispatchHelper")
+            self.dispatcher = self.service.dispatcher
             self.nolocale = Locale("zxx", "", "")
             self.inlinesnippet = False
             self.activepreviews = 0
             self.lexername = None
-
-            # install gettext
-            locdir = os.path.join(uno.fileUrlToSystemPath(self.extpath), "locales")
-            logger.debug(f'Locales folder: {locdir}')
-            # ps = self.create("com.sun.star.util.PathSubstitution")
-            # vlang = ps.getSubstituteVariableValue("vlang")
-            # lang = vlang.split("-")[0]
-            # gtlang = gettext.translation('ch2', localedir=locdir, languages=[lang], fallback=True)
-            gtlang = gettext.translation('ch2', localedir=locdir, fallback=True)
-            gtlang.install(names=['_', 'ngettext'])
-            _ = gtlang.gettext
-            ngettext = gtlang.ngettext
+            self.inbatch = False
+            self.batchcharstyles = None    # character styles referenced by the current batch
+            self._charstylenames = None
+            self._registry = None
+            self.force = False      # update snippets even if unchanged
+            self._parastyles = None
+            self.parastylesfiller = None    # pending ParaStylesFiller of the options dialog
 
         except Exception:
             logger.exception("Error initializing python class CodeHighlighter:")
@@ -288,14 +833,10 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             return
         elif self.selection:
             logger.debug("Undoing existing previews on dialog closing.")
-            while self.activepreviews:
-                self.undomanager.undo()
-                self.undomanager.clearRedo()
-                self.activepreviews -= 1
+            self.undopreviews(clearredo=True)
             if ret == 1:
                 logger.debug("Starting highlights.")
-                for code_block in self.selection:
-                    self.prepare_highlight(code_block)
+                self.highlight_blocks(self.selection)
         elif ret != 0:
             logger.debug("Current selection contains no text.")
             self.msgbox(_("Nothing to highlight."))
@@ -307,8 +848,7 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
         if selection == INVALID_SELECTION:
             self.msgbox(_("Unsupported selection."))
         elif selection:
-            for code_block in selection:
-                self.prepare_highlight(code_block)
+            self.highlight_blocks(selection)
         else:
             logger.debug("Current selection contains no text.")
             self.msgbox(_("Nothing to highlight."))
@@ -318,14 +858,13 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
         Code-blocks must have been highlighted at least once with Code Highlighter 2.'''
 
         hasupdates = False
+        # an explicit update also repairs damaged formatting, so unchanged snippets are not skipped
+        self.force = True
         selection = self.check_selection()
         if selection == INVALID_SELECTION:
             self.msgbox(_("Unsupported selection."))
         elif selection:
-            for code_block in selection:
-                ret = self.prepare_highlight(code_block, updatecode=True)
-                if not hasupdates:
-                    hasupdates = ret
+            hasupdates = self.highlight_blocks(selection, updatecode=True)
             if not hasupdates:
                 logger.debug("Selection is not updatable.")
                 self.msgbox(_("Update impossible: no formatting attribute associated with this code."))
@@ -335,16 +874,37 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
 
     def do_preview(self, dialog):
         logger.debug("Undoing existing previews before creating new ones.")
-        while self.activepreviews:
-            self.undomanager.undo()
-            self.activepreviews -= 1
+        self.undopreviews()
         choices = self.get_options_from_dialog(dialog)
         if choices:
             logger.debug("Creating previews.")
             self.options.update(choices)
-            for code_block in self.selection:
-                self.prepare_highlight(code_block)
-                self.activepreviews += 1
+            # one undo entry per preview, whatever the number of snippets
+            self.highlight_blocks(self.selection)
+            self.activepreviews += 1
+
+    def undopreviews(self, clearredo=False):
+        '''Undo active previews, and forget the character styles they may have created.'''
+
+        if not self.activepreviews:
+            return
+        while self.activepreviews:
+            self.undomanager.undo()
+            if clearredo:
+                self.undomanager.clearRedo()
+            self.activepreviews -= 1
+        self._charstylenames = None
+
+    def do_retheme(self):
+        '''Switch all highlighted snippets of the active document to the style chosen in the retheme dialog.'''
+
+        stylename = self.choose_retheme_style()
+        if not stylename:
+            logger.debug("Retheme canceled.")
+            return
+        logger.debug(f"Retheming document with {stylename} style.")
+        self.retheme(stylename)
+        self.msgbox(_("Done."), boxtype=INFOBOX, title=_("Retheme document"))
 
     def do_removealltags(self):
         '''Remove all highlighting infos inserted with Code Highlighter 2
@@ -372,58 +932,69 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             return int(hex_str[-6:], 16)
         return 0
 
-    def setlogger(self):
-        loglevel = LOGLEVEL.get(self.options["LogLevel"], 0)
-        logger.setLevel(loglevel)
-        if self.options["LogToFile"] == 0:
-            for h in logger.handlers:
-                if isinstance(h, logging.FileHandler):
-                    logger.removeHandler(h)
-                    return
-        else:
-            for h in logger.handlers:
-                if isinstance(h, logging.FileHandler):
-                    return
-            logger.addHandler(filehandler)
-
-    def create_cfg_access(self):
-        '''Return an updatable instance of the codehighlighter node in LO registry. '''
-
-        cfg = self.create('com.sun.star.configuration.ConfigurationProvider')
-        prop = PropertyValue('nodepath', 0, '/ooo.ext.code-highlighter.Registry/Settings', 0)
-        cfg_access = cfg.createInstanceWithArguments('com.sun.star.configuration.ConfigurationUpdateAccess', (prop,))
-        return cfg_access
+    @property
+    def parastyles(self):
+        '''Paragraph styles in use, {display name: name}, checked once per trigger.'''
 
-    def load_options(self):
-        properties = self.cfg_access.ElementNames
-        values = self.cfg_access.getPropertyValues(properties)
-        return dict(zip(properties, values))
+        if self._parastyles is None:
+            self._parastyles = self.loadparastyles()
+        return self._parastyles
 
     def loadparastyles(self):
         if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
             parastyles = self.doc.StyleFamilies.ParagraphStyles
-            return {parastyles.getByName(name).DisplayName: name for name in parastyles.ElementNames if name != "Standard" and parastyles.getByName(name).isInUse()}
+            # isInUse() can not be cached: applying a style to a paragraph fires no event
+            return {displayname: name for displayname, name in self.parastylenames(parastyles).items()
+                    if parastyles.getByName(name).isInUse()}
         else:
             return {}
 
-    def getallstyles(self):
-        all_styles = list(get_all_styles()) + ['libreoffice-classic', 'libreoffice-dark']
-        return sorted(all_styles, key=lambda x: (x != 'default', x.casefold()))
+    def parastylenames(self, parastyles):
+        '''
+        Return {display name: name} of the paragraph styles of the document but the default one,
+        cached per document as long as the style names are unchanged.
+        '''
+
+        uid = self.doc.RuntimeUID
+        elementnames = parastyles.ElementNames
+        cached = PARASTYLES.get(uid)
+        if cached is None or cached[0] != elementnames:
+            names = {parastyles.getByName(name).DisplayName: name for name in elementnames if name != "Standard"}
+            if not self.watchdocument():
+                return names
+            cached = PARASTYLES[uid] = (elementnames, names)
+        return cached[1]
+
+    def fill_parastyles(self, dialog):
+        '''Populate the paragraph style list box of the options dialog.'''
+
+        try:
+            lb_parastyle = dialog.getControl('lb_parastyle')
+            if self.parastyles:
+                lb_parastyle.addItems(sorted(self.parastyles.keys(), key=str.casefold), 0)
+                if SELECTED_PARASTYLE and SELECTED_PARASTYLE.get(self.doc.RuntimeUID, None) in self.parastyles:
+                    lb_parastyle.selectItem(SELECTED_PARASTYLE.get(self.doc.RuntimeUID, None), True)
+                for controlname in ("lb_parastyle", "btn_parastyle", "para_line"):
+                    dialog.getControl(controlname).setEnable(True)
+            else:
+                lb_parastyle.setEnable(False)
+                if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
+                    lb_parastyle.Model.HelpText += _(" (There is currently no style in use.)")
+                else:
+                    lb_parastyle.Model.HelpText += _(" (Writer only.)")
+                dialog.getControl("btn_parastyle").setEnable(False)
+                dialog.getControl("para_line").setEnable(False)
+        except Exception:
+            logger.exception("Error while filling paragraph styles:")
 
     def create_dialog(self):
         '''Load, populate and return options dialog.'''
 
-        # get_all_lexers() returns: (longname, tuple of aliases, tuple of filename patterns, tuple of mimetypes)
         logger.debug("Starting options dialog.")
-        _all_lexers = list(get_all_lexers())
-        # let's add a convenient shortcut to VB.net lexer for LOBasic
-        _all_lexers.append(("LibreOffice Basic", (), (), ()))
-        all_lexers = sorted((lex[0] for lex in _all_lexers), key=str.casefold)
-        self.all_lexer_aliases = [lex[0].lower() for lex in _all_lexers]
-        for lex in _all_lexers:
-            self.all_lexer_aliases.extend(list(lex[1]))
+        catalog = self.service.catalog
+        all_lexers = catalog.lexernames
         logger.debug("--> getting lexers ok.")
-        self.all_styles = self.getallstyles()
+        self.all_styles = catalog.styles
         logger.debug("--> getting styles ok.")
 
         dialog_provider = self.create("com.sun.star.awt.DialogProvider2")
@@ -478,18 +1049,14 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             cb_style.Text = style
         cb_style.addItems(self.all_styles, 0)
 
-        if self.parastyles:
-            lb_parastyle.addItems(sorted(self.parastyles.keys(), key=str.casefold), 0)
-            if SELECTED_PARASTYLE and SELECTED_PARASTYLE.get(self.doc.RuntimeUID, None) in self.parastyles:
-                lb_parastyle.selectItem(SELECTED_PARASTYLE.get(self.doc.RuntimeUID, None), True)
+        if self._parastyles is not None:
+            self.fill_parastyles(dialog)
         else:
-            lb_parastyle.setEnable(False)
-            if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
-                lb_parastyle.Model.HelpText += _(" (There is currently no style in use.)")
-            else:
-                lb_parastyle.Model.HelpText += _(" (Writer only.)")
-            dialog.getControl("btn_parastyle").setEnable(False)
-            dialog.getControl("para_line").setEnable(False)
+            # isInUse() is slow on big documents, so check styles once the dialog is displayed
+            for controlname in ("lb_parastyle", "btn_parastyle", "para_line"):
+                dialog.getControl(controlname).setEnable(False)
+            self.parastylesfiller = ParaStylesFiller(self, dialog)
+            self.create("com.sun.star.awt.AsyncCallback").addCallback(self.parastylesfiller, None)
 
         check_col_bg.State = self.options['ColourizeBackground']
         check_charstyles.State = state1 = self.options['UseCharStyles']
@@ -508,22 +1075,32 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
         logger.debug("Dialog returned.")
         return dialog
 
-    def getextinfos(self):
-        pip = self.ctx.getByName("/singletons/com.sun.star.deployment.PackageInformationProvider")
-        extensions = pip.getExtensionList()
-        extid = "javahelps.codehighlighter"
-        extpath = pip.getPackageLocation(extid)
-        extver = ""
-        for e in extensions:
-            if extid in e:
-                extver = e[1]
-        return extpath, extver
+    def choose_retheme_style(self):
+        '''Return the style chosen in the retheme dialog, or None if canceled.'''
+
+        styles = self.service.catalog.styles
+        dialog_provider = self.create("com.sun.star.awt.DialogProvider2")
+        dialog = dialog_provider.createDialog(
+            "vnd.sun.star.extension://javahelps.codehighlighter/dialogs/Retheme.xdl")
+        dialog.Title = _("Retheme document")
+        dialog.getControl('label_style').Model.Label = _("Style")
+        cb_style = dialog.getControl('cb_style')
+        style = self.options['Style']
+        if style in styles:
+            cb_style.Text = style
+        cb_style.addItems(styles, 0)
+        while dialog.execute():
+            style = cb_style.Text.strip()
+            if style in styles:
+                return style
+            self.msgbox(_("Unknown style."))
+        return None
 
     def get_options_from_dialog(self, dialog):
         opt = {}
         lang = dialog.getControl('cb_lang').Text.strip() or 'automatic'
         style = dialog.getControl('cb_style').Text.strip() or 'default'
-        if lang != 'automatic' and lang.lower() not in self.all_lexer_aliases:
+        if lang != 'automatic' and not self.service.catalog.haslexer(lang):
             self.msgbox(_("Unsupported language."))
         elif style not in self.all_styles:
             self.msgbox(_("Unknown style."))
@@ -552,6 +1129,8 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
         # dialog.setVisible(True)
         dialog = self.create_dialog()
         ret = dialog.execute()
+        if self.parastylesfiller is not None:
+            self.parastylesfiller.cancel()
         if ret == 0:
             logger.debug("Dialog canceled.")
             return ret
@@ -567,24 +1146,45 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
 
     def save_options(self, choices):
         self.options.update(choices)
-        self.cfg_access.setPropertyValues(tuple(choices.keys()), tuple(choices.values()))
-        self.cfg_access.commitChanges()
+        self.service.save_options(choices)
+
+    def pooledlexer(self, lexerclass):
+        '''Return a shared lexer instance, configured for code highlighting.'''
+
+        # prevent offset color if selection start with empty line
+        return lexerpool.get(lexerclass, stripnl=False)
 
     def getlexerbyname(self, lexername):
-        if lexername == 'LibreOffice Basic':
-            lexername = "VB.net"
-        try:
-            return get_lexer_by_name(lexername)
-        except pygments.util.ClassNotFound:
-            # get_lexer_by_name() only checks aliases, not the actual longname
-            for lex in get_all_lexers():
-                if lex[0].lower() == lexername.lower():
-                    # found the longname, use the first alias
-                    return get_lexer_by_name(lex[1][0])
-            else:
-                raise
+        lexerclass = self.service.catalog.lexerclass(lexername)
+        if lexerclass is None:
+            # unknown name, let pygments raise ClassNotFound
+            lexerclass = find_lexer_class_by_name(lexername)
+        return self.pooledlexer(lexerclass)
+
+    def detectlexer(self, code):
+        '''Return the lexer guessed from code, memoized per document.'''
+
+        uid = self.doc.RuntimeUID
+        memo = DETECTIONS.get(uid)
+        if memo is None:
+            if not self.watchdocument():
+                # nothing would release the memo
+                return self.pooledlexer(DetectionMemo().guess(code))
+            memo = DETECTIONS[uid] = DetectionMemo()
+        return self.pooledlexer(memo.guess(code))
+
+    def watchdocument(self):
+        '''Have per-document resources released when the document is closed. Return False if it has no events.'''
+
+        uid = self.doc.RuntimeUID
+        if uid not in DOCUMENT_WATCHERS:
+            try:
+                DOCUMENT_WATCHERS[uid] = DocumentWatcher(self.doc)
+            except AttributeError:
+                return False
+        return True
 
-    def guesslexer(self, code_block):
+    def guesslexer(self, code_block, code=None):
         try:
             udas = code_block.UserDefinedAttributes
         except AttributeError:
@@ -594,80 +1194,323 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 udas = code_block.ParaUserDefinedAttributes
         except Exception:
             logger.exception("")
-            return guess_lexer(code_block.String)
+            return self.detectlexer(code_block.String if code is None else code)
         if udas is None or SNIPPETTAGID not in udas:
-            return guess_lexer(code_block.String)
+            return self.detectlexer(code_block.String if code is None else code)
         else:
-            options = literal_eval(udas.getByName(SNIPPETTAGID).Value)
+            options = self.getsnippetoptions(udas)
             logger.info('lexer name gotten from from snippet tag')
-            if options['Language'] == "Text only":
-                return guess_lexer(code_block.String)
+            if options.get('Language', "Text only") in ("Text only", 'automatic'):
+                return self.detectlexer(code_block.String if code is None else code)
             else:
                 return self.getlexerbyname(options['Language'])
 
-    def getlexer(self, code_block):
+    def getlexer(self, code_block, code=None):
         lang = self.options['Language']
         if lang == 'automatic':
-            lexer = self.guesslexer(code_block)
+            lexer = self.guesslexer(code_block, code)
             logger.info(f'Automatic lexer choice : {lexer.name}')
         else:
             lexer = self.getlexerbyname(lang)
-        # prevent offset color if selection start with empty line
-        lexer.stripnl = False
         self.lexername = lexer.name
         return lexer
 
-    def createcharstyles(self, style, styleprefix):
+    @property
+    def charstylenames(self):
+        '''
+        Registry of the existing character style names of the document, loaded once per trigger:
+        styles can be removed between triggers by undo, which notifies no listener.
+        '''
+
+        if self._charstylenames is None:
+            self._charstylenames = set(self.doc.StyleFamilies.CharacterStyles.ElementNames)
+        return self._charstylenames
+
+    def createcharstyles(self, style, styleprefix, ttypes=None):
+        '''
+        Create the character styles of the token types <ttypes> (all those of the style by default),
+        with their parents. Styles already registered in the document are skipped.
+        '''
+
         def addstyle(ttype):
-            newcharstyle = self.doc.createInstance("com.sun.star.style.CharacterStyle")
             ttypename = str(ttype).replace('Token', styleprefix)
+            if ttypename in existing:
+                return
+            newcharstyle = self.doc.createInstance("com.sun.star.style.CharacterStyle")
             try:
                 charstyles.insertByName(ttypename, newcharstyle)
             except ElementExistException:
+                existing.add(ttypename)
                 return
+            existing.add(ttypename)
             if ttype.parent is not None:
                 parent = ttypename.rsplit('.', 1)[0]
-                if not charstyles.hasByName(parent):
-                    addstyle(ttype.parent)
+                addstyle(ttype.parent)
                 newcharstyle.ParentStyle = parent
             elif mastercharstyle:
-                if not charstyles.hasByName(mastercharstyle):
+                if mastercharstyle not in existing:
                     master = self.doc.createInstance("com.sun.star.style.CharacterStyle")
-                    charstyles.insertByName(mastercharstyle, master)
+                    try:
+                        charstyles.insertByName(mastercharstyle, master)
+                    except ElementExistException:
+                        pass
+                    existing.add(mastercharstyle)
                 newcharstyle.ParentStyle = mastercharstyle
-            tok_style = style.style_for_token(ttype)
-            if tok_style.get('italic', ''):
-                newcharstyle.CharPosture = SL_ITALIC
-            if tok_style.get('noitalic', ''):
-                newcharstyle.CharPosture = SL_NONE
-            if tok_style.get('bold', ''):
-                newcharstyle.CharWeight = W_BOLD
-            if tok_style.get('nobold', ''):
-                newcharstyle.CharWeight = W_NORMAL
-            if tok_style.get('underline', ''):
-                newcharstyle.CharUnderline = UL_SINGLE
-            if tok_style.get('nounderline', ''):
-                newcharstyle.CharUnderline = UL_NONE
-            if tok_style.get("bgcolor", ''):
-                newcharstyle.CharBackColor = self.to_int(tok_style["bgcolor"])
-            if tok_style.get("color", ''):
-                newcharstyle.CharColor = self.to_int(tok_style["color"])
+            self.settokenstyle(newcharstyle, style.style_for_token(ttype))
 
         mastercharstyle = self.options["MasterCharStyle"].strip()
         stylefamilies = self.doc.StyleFamilies
         charstyles = stylefamilies.CharacterStyles
-        for ttype in sorted(style.styles.keys()):
+        existing = self.charstylenames
+        if ttypes is None:
+            ttypes = style.styles.keys()
+        for ttype in sorted(ttypes):
             addstyle(ttype)
 
-    def cleancharstyles(self, styleprefix):
+    @property
+    def registry(self):
+        '''Snippet registry of the document, loaded once.'''
+
+        if self._registry is None:
+            self._registry = SnippetRegistry(self.doc)
+        return self._registry
+
+    def registersnippet(self, code_block, udas):
+        '''Register code_block in the snippet registry and return its snippet ID.'''
+
+        registry = self.registry
+        snippetid = None
+        if SNIPPETTAGID in udas:
+            snippetid = parsetag(udas.getByName(SNIPPETTAGID).Value)[0]
+        # a copied snippet holds the ID of its original
+        if snippetid is None or not registry.owns(snippetid, code_block):
+            snippetid = registry.newid()
+        registry.register(snippetid, code_block, inline=self.inlinesnippet)
+        return snippetid
+
+    def isregistered(self, code_block, udas):
+        '''Check that the snippet tagged with udas is registered at the place of code_block.'''
+
+        snippetid = parsetag(udas.getByName(SNIPPETTAGID).Value)[0]
+        return snippetid is not None and self.registry.owns(snippetid, code_block)
+
+    def getsnippetoptions(self, udas):
+        '''Return the options a snippet has been highlighted with, from its tag in udas.'''
+
+        value = udas.getByName(SNIPPETTAGID).Value
+        snippetid, optionsid, checksum, _ = parsetag(value)
+        if optionsid is None:
+            # legacy tag, migrated when the snippet is tagged again
+            return literal_eval(value)
+        registry = self.registry
+        optionset = registry.optionsets.get(optionsid)
+        # options set IDs are document-local: a snippet pasted from another document
+        # refers to an unrelated set (tags without checksum predate pasting checks)
+        if optionset is not None and checksum in (None, registry.checksum(optionset)):
+            return dict(optionset)
+        logger.warning(f"Options of snippet {snippetid} not found, saved options used with automatic language.")
+        options = {k: v for k, v in self.service.options.items() if not k.startswith('Log')}
+        options['Language'] = 'automatic'
+        return options
+
+    def snippetbookmark(self, textrange, tag):
+        '''
+        Return the range of the bookmark of the snippet tagged with <tag> around textrange,
+        or None for legacy tags and snippets without bookmark.
+        '''
+
+        snippetid = parsetag(tag)[0]
+        if snippetid is None:
+            return None
+        return self.registry.bookmarkedrange(snippetid, textrange)
+
+    def tagoptions(self, lexername):
+        '''Return the options stored with a snippet highlighted with lexer <lexername>.'''
+
+        options = {k: self.options[k] for k in self.options if not k.startswith('Log')}
+        options['Language'] = lexername
+        return options
+
+    def snippethash(self, code, options):
+        '''Return a compact hash of the code and options of a snippet, and of Pygments and extension versions.'''
+
+        h = blake2b(digest_size=8)
+        h.update(f'{pygments.__version__}:{self.extver}:{sorted(options.items())}'.encode('utf-8'))
+        h.update(code.encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+    def snippettext(self, code_block, code=None):
+        '''
+        Return the text of a snippet, over entire paragraphs for text blocks, as they are found on update.
+        code: text of the snippet as highlighted, if already known
+        '''
+
+        if code is not None and not self.options['ShowLineNumbers']:
+            # line numbers are inserted after the text is read
+            return code
+
+        if code_block.ImplementationName in ("SwXTextRange", "SwXTextCursor") and not self.inlinesnippet:
+            return self.ensure_paragraphs(code_block).String
+        return code_block.String
+
+    def isuptodate(self, code_block, udas, code=None):
+        '''
+        Check whether a tagged snippet is unchanged since it was highlighted, with the options it would be
+        updated with, from the hash stored in its tag. Always False when updates are forced.
+        code: text of code_block, if already known
+        '''
+
+        if self.force:
+            return False
+        try:
+            digest = parsetag(udas.getByName(SNIPPETTAGID).Value)[3]
+            if digest is None:
+                return False
+            lexername = self.options['Language']
+            if lexername == 'automatic':
+                # same text, same detection
+                lexername = self.getsnippetoptions(udas).get('Language')
+            options = self.tagoptions(lexername)
+            if not self.charstylesavailable:
+                options["UseCharStyles"] = False
+            uptodate = digest == self.snippethash(code_block.String if code is None else code, options)
+        except Exception:
+            logger.exception("")
+            return False
+        if uptodate:
+            logger.debug(f'Snippet unchanged, not updated (type: {code_block.ImplementationName}).')
+        return uptodate
+
+    def untag(self, udas):
+        '''Remove the Code Highlighter tag from user defined attributes. Return True if it was found.'''
+
+        if udas and SNIPPETTAGID in udas:
+            udas.removeByName(SNIPPETTAGID)
+            return True
+        return False
+
+    def settokenstyle(self, charstyle, tok_style):
+        '''Set the attributes of a Pygments token style on a character style.'''
+
+        if tok_style.get('italic', ''):
+            charstyle.CharPosture = SL_ITALIC
+        if tok_style.get('noitalic', ''):
+            charstyle.CharPosture = SL_NONE
+        if tok_style.get('bold', ''):
+            charstyle.CharWeight = W_BOLD
+        if tok_style.get('nobold', ''):
+            charstyle.CharWeight = W_NORMAL
+        if tok_style.get('underline', ''):
+            charstyle.CharUnderline = UL_SINGLE
+        if tok_style.get('nounderline', ''):
+            charstyle.CharUnderline = UL_NONE
+        if tok_style.get("bgcolor", ''):
+            charstyle.CharBackColor = self.to_int(tok_style["bgcolor"])
+        if tok_style.get("color", ''):
+            charstyle.CharColor = self.to_int(tok_style["color"])
+
+    def redefinecharstyles(self, style, styleprefix, oldprefixes, code_blocks=()):
+        '''
+        Turn the character styles of other Pygments styles (<oldprefixes>) into those of <style>:
+        they are renamed with <styleprefix> and their attributes are rewritten, so that
+        text formatted with them follows without being touched.
+        Old styles whose new name already exists are merged instead: the text of <code_blocks>
+        is moved to the existing style, and the old style is removed once unused.
+        Return the number of redefined character styles.
+        '''
+
+        charstyles = self.doc.StyleFamilies.CharacterStyles
+        registry = self.charstylenames
+        redefined = 0
+        renamed = []
+        merged = {}
+        for oldprefix in oldprefixes:
+            if oldprefix == styleprefix:
+                continue
+            names = [n for n in charstyles.ElementNames if n == oldprefix or n.startswith(f'{oldprefix}.')]
+            for name in names:
+                suffix = name[len(oldprefix):]
+                newname = styleprefix + suffix
+                if newname in registry or charstyles.hasByName(newname):
+                    merged[name] = newname
+                    continue
+                # text formatted with the style follows its new name
+                charstyle = charstyles.getByName(name)
+                charstyle.setName(newname)
+                registry.discard(name)
+                registry.add(newname)
+                renamed.append((charstyle, newname))
+                ttype = string_to_tokentype('Token' + suffix)
+                while ttype not in style._styles:
+                    ttype = ttype.parent
+                charstyle.setPropertiesToDefault(("CharBackColor", "CharColor", "CharPosture",
+                                                  "CharUnderline", "CharWeight"))
+                self.settokenstyle(charstyle, style.style_for_token(ttype))
+                redefined += 1
+        if merged:
+            # renamed styles may still inherit from merged ones
+            for charstyle, newname in renamed:
+                if '.' in newname:
+                    charstyle.ParentStyle = newname.rsplit('.', 1)[0]
+            self.mergecharstyles(merged, code_blocks)
+            redefined += len(merged)
+        return redefined
+
+    def mergecharstyles(self, merged, code_blocks):
+        '''
+        Move the text of <code_blocks> from old character styles to new ones,
+        then remove the old styles left unused.
+        merged: old style name -> new style name
+        '''
+
+        for code_block in code_blocks:
+            try:
+                for para in code_block.createEnumeration():
+                    if not para.supportsService('com.sun.star.text.Paragraph'):
+                        continue
+                    for portion in para:
+                        newname = merged.get(portion.CharStyleName)
+                        if newname is not None:
+                            portion.CharStyleName = newname
+            except Exception:
+                logger.exception(f"Character styles of snippet could not be merged (type: {code_block.ImplementationName}).")
+
+        charstyles = self.doc.StyleFamilies.CharacterStyles
+        registry = self.charstylenames
+        keep = set()
+        # children first, parents of kept styles are kept
+        for name in sorted(merged, key=lambda x: x.count('.'), reverse=True):
+            charstyle = charstyles.getByName(name)
+            if name in keep or charstyle.isInUse():
+                if charstyle.ParentStyle:
+                    keep.add(charstyle.ParentStyle)
+            else:
+                charstyles.removeByName(name)
+                registry.discard(name)
+
+    def cleancharstyles(self, inuse=()):
+        '''
+        Remove the Code Highlighter character styles that are not used anymore.
+        inuse: style names known to be in use (referenced by the plans just applied),
+               they and their ancestors are kept without asking LibreOffice.
+        '''
+
         # see discussion in issue #52
         try:
             stylefamilies = self.doc.StyleFamilies
             charstyles = stylefamilies.CharacterStyles
 
-            csnames = [s for s in charstyles.ElementNames if (s.startswith('ch2') or s.startswith(f'{styleprefix}.'))]
-            csnames.sort(key=lambda x: x.count('.'), reverse=True)
             keep = set()
+            for csname in inuse:
+                while csname not in keep:
+                    keep.add(csname)
+                    if '.' not in csname:
+                        break
+                    csname = csname.rsplit('.', 1)[0]
+            # all style prefixes start with CHARSTYLEID
+            csnames = [s for s in charstyles.ElementNames if s.startswith('ch2') and s not in keep]
+            csnames.sort(key=lambda x: x.count('.'), reverse=True)
+            registry = self.charstylenames
             for csname in csnames:
                 cs = charstyles.getByName(csname)
                 if csname in keep or cs.isInUse():
@@ -675,6 +1518,7 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         keep.add(cs.ParentStyle)
                 else:
                     charstyles.removeByName(csname)
+                    registry.discard(csname)
         except AttributeError:
             pass
 
@@ -686,7 +1530,7 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
         else:
             return get_style_by_name(name)
 
-    def tagcodeblock(self, code_block, lexername):
+    def tagcodeblock(self, code_block, lexername, code=None):
         if not self.options["StoreOptionsWithSnippet"]:
             return
         if self.inlinesnippet:
@@ -701,9 +1545,19 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 logger.exception("")
                 return
         if udas is not None:
-            _options = {k: self.options[k] for k in self.options if not k.startswith('Log')}
-            _options['Language'] = lexername
-            options = AttributeData(Type="CDATA", Value=f'{_options}')
+            _options = self.tagoptions(lexername)
+            try:
+                registry = self.registry
+                snippetid = self.registersnippet(code_block, udas)
+                digest = self.snippethash(self.snippettext(code_block, code), _options)
+                value = (f'{TAGFORMAT}:{snippetid}:{registry.optionsid(_options)}:{registry.checksum(_options)}'
+                         f':{digest}')
+                if not self.inbatch:
+                    registry.save()
+            except Exception:
+                logger.exception("Snippet could not be registered, options stored in tag.")
+                value = f'{_options}'
+            options = AttributeData(Type="CDATA", Value=value)
             try:
                 udas.insertByName(SNIPPETTAGID, options)
             except ElementExistException:
@@ -743,10 +1597,13 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
         # TEXT SHAPES
         if selected_item.ImplementationName == "com.sun.star.drawing.SvxShapeCollection":
             logger.debug("Checking selection: com.sun.star.drawing.SvxShapeCollection.")
+            editmode = True
             for code_block in selected_item:
                 if code_block.String.strip():
-                    # exit edit mode if necessary
-                    self.dispatcher.executeDispatch(self.frame, ".uno:SelectObject", "", 0, ())
+                    if editmode:
+                        # exit edit mode if necessary
+                        self.dispatcher.executeDispatch(self.frame, ".uno:SelectObject", "", 0, ())
+                        editmode = False
                     try:
                         if code_block.TextBox:
                             code_blocks.append(code_block.TextBoxContent)
@@ -769,9 +1626,7 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     else:
                         udas = code_block.ParaUserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        cursor = self.ensure_paragraphs(code_block)
-                        self.doc.CurrentController.select(cursor)
-                        code_blocks.append(self.doc.CurrentSelection[0])
+                        code_blocks.append(self.ensure_paragraphs(code_block))
                     elif code_block.TextFrame and code_block.Text.String.strip():
                         code_blocks.append(code_block.TextFrame)
                     elif code_block.TextTable and code_block.Text.String.strip():
@@ -830,12 +1685,62 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
 
         return code_blocks
 
-    def prepare_highlight(self, code_block, updatecode=False):
-        if not self.doc.hasControllersLocked():
+    @contextmanager
+    def batchscope(self, title):
+        '''
+        Group the highlighting of several snippets: controllers are locked once,
+        a single undo context is opened and draw pane syncing is deferred to the end,
+        so that layout is recalculated once for the whole batch.
+        '''
+
+        if self.inbatch:
+            yield
+            return
+        self.inbatch = True
+        self.batchcharstyles = None
+        self.doc.lockControllers()
+        logger.debug("Controllers locked for batch.")
+        self.undomanager.enterUndoContext(title)
+        try:
+            yield
+        finally:
+            self.inbatch = False
+            try:
+                if self.batchcharstyles is not None:
+                    self.cleancharstyles(self.batchcharstyles)
+            finally:
+                self.batchcharstyles = None
+                if self._registry is not None:
+                    self._registry.save()
+                try:
+                    self.undomanager.leaveUndoContext()
+                except InvalidStateException:
+                    pass
+                if self.doc.hasControllersLocked():
+                    self.doc.unlockControllers()
+                    logger.debug("Controllers unlocked after batch.")
+
+    def highlight_blocks(self, code_blocks, updatecode=False):
+        '''
+        Highlight a list of code blocks, in a single batch if more than one.
+        Return True if any of them has been highlighted.
+        '''
+
+        if len(code_blocks) == 1:
+            return bool(self.prepare_highlight(code_blocks[0], updatecode=updatecode))
+        hascode = False
+        with self.batchscope(f"code highlight: {len(code_blocks)} snippets"):
+            for code_block in code_blocks:
+                hascode = self.prepare_highlight(code_block, updatecode=updatecode) or hascode
+        return hascode
+
+    def prepare_highlight(self, code_block, updatecode=False, code=None):
+        '''code: text of code_block, if already known (over entire paragraphs for text snippets)'''
+
+        if not self.inbatch and not self.doc.hasControllersLocked():
             self.doc.lockControllers()
             logger.debug("Controllers locked.")
 
-        controller = self.doc.CurrentController
         hascode = True
         try:
             # cancel the use of character styles if context is not relevant
@@ -845,12 +1750,15 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             # TEXT SHAPE
             if code_block.ImplementationName in ("SwXShape", "SvxShapeText", "com.sun.star.comp.sc.ScShapeObj"):
                 logger.debug("Dealing with text shape.")
+                block = BlockSnapshot(code_block, code)
 
                 if updatecode:
                     udas = code_block.UserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        options = literal_eval(udas.getByName(SNIPPETTAGID).Value)
+                        options = self.getsnippetoptions(udas)
                         self.options.update(options)
+                        if self.isuptodate(code_block, udas, block.code):
+                            return True
                     else:
                         hascode = False
 
@@ -862,17 +1770,19 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     if self.options['ShowLineNumbers']:
                         _style = style.style_for_token(("Comment",))
                         lineno_color = self.to_int(_style['color'])
-                    lexer = self.getlexer(code_block)
+                    lexer = self.getlexer(code_block, block.code)
 
                     undoaction = UndoAction(self.doc, code_block,
-                                            f"code highlight (lang: {lexer.name}, style: {stylename})")
+                                            f"code highlight (lang: {lexer.name}, style: {stylename})", text=block.code)
                     logger.debug("Custom undo action created.")
-                    self.show_line_numbers(code_block, False)
+                    if self.show_line_numbers(code_block, False, code=block.code):
+                        block.refresh()
                     cursor = code_block.createTextCursorByRange(code_block)
                     cursor.CharLocale = self.nolocale
-                    self.highlight_code(cursor, lexer, style, checkunicode=True)
+                    self.highlight_code(cursor, lexer, style, code=block.code, checkunicode=True)
                     # unlock controllers here to force left pane syncing in draw/impress
-                    if self.doc.supportsService("com.sun.star.drawing.GenericDrawingDocument"):
+                    # (a batch does it once, when it ends)
+                    if not self.inbatch and self.doc.supportsService("com.sun.star.drawing.GenericDrawingDocument"):
                         self.doc.unlockControllers()
                         logger.debug("Controllers unlocked.")
                     # code_block.FillStyle = FS_NONE
@@ -880,9 +1790,9 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         code_block.FillStyle = FS_SOLID
                         code_block.FillColor = self.to_int(bg_color)
                     if self.options['ShowLineNumbers']:
-                        self.show_line_numbers(code_block, True, charcolor=lineno_color)
+                        self.show_line_numbers(code_block, True, charcolor=lineno_color, code=block.code)
                     # save options as user defined attribute
-                    self.tagcodeblock(code_block, lexer.name)
+                    self.tagcodeblock(code_block, lexer.name, block.code)
                     # model is not considered as modified after textbox formatting
                     self.doc.setModified(True)
                     undoaction.get_new_state()
@@ -892,7 +1802,8 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             # PLAIN TEXT
             elif code_block.ImplementationName in ("SwXTextRange", "SwXTextCursor"):
                 logger.debug("Dealing with plain text.")
-                self.checkinlinesnippet(code_block)
+                selection = BlockSnapshot(code_block, code)
+                self.checkinlinesnippet(code_block, selection.code)
 
                 if updatecode:
                     if self.inlinesnippet:
@@ -900,11 +1811,12 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     else:
                         udas = code_block.ParaUserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        options = literal_eval(udas.getByName(SNIPPETTAGID).Value)
+                        options = self.getsnippetoptions(udas)
                         self.options.update(options)
-                        cursor = self.ensure_paragraphs(code_block)
-                        self.doc.CurrentController.select(cursor)
-                        code_block = self.doc.CurrentSelection[0]
+                        code_block = self.ensure_paragraphs(code_block, selection.code)
+                        selection.refresh(code_block)
+                        if self.isuptodate(code_block, udas, selection.code):
+                            return True
                     else:
                         hascode = False
 
@@ -918,29 +1830,26 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         lineno_color = self.to_int(_style['color'])
 
                     try:
-                        cursor = self.ensure_paragraphs(code_block)
-                        lexer = self.getlexer(cursor)
+                        cursor = self.ensure_paragraphs(code_block, selection.code)
+                        # known code and updated snippets already span entire paragraphs
+                        block = BlockSnapshot(cursor, selection.code if updatecode or code is not None else None)
+                        lexer = self.getlexer(cursor, block.code)
                         self.undomanager.enterUndoContext(f"code highlight (lang: {lexer.name}, style: {stylename})")
-                        self.show_line_numbers(code_block, False, isplaintext=True)
-                        cursor = self.ensure_paragraphs(code_block)  # in case numbering was removed, code_block has changed
-                        controller.select(cursor)
+                        if self.show_line_numbers(code_block, False, isplaintext=True, code=selection.code):
+                            cursor = self.ensure_paragraphs(code_block)  # numbering was removed, code_block has changed
+                            block.refresh(cursor)
                         cursor.CharLocale = self.nolocale
                         char_bg_color = None
                         if bg_color and not self.inlinesnippet:
-                            # ParaBackColor does not work anymore, and new FillProperties isn't available from API
-                            # see https://bugs.documentfoundation.org/show_bug.cgi?id=99125
-                            # so let's use the dispatcher as workaround
-                            # cursor.ParaBackColor = self.to_int(bg_color)
-                            prop = PropertyValue(Name="BackgroundColor", Value=self.to_int(bg_color))
-                            self.dispatcher.executeDispatch(self.frame, ".uno:BackgroundColor", "", 0, (prop,))
+                            self.setparabackcolor(cursor, self.to_int(bg_color))
                         elif self.inlinesnippet:
                             char_bg_color = bg_color
-                        self.highlight_code(cursor, lexer, style, char_bg_color=char_bg_color)
+                        self.highlight_code(cursor, lexer, style, char_bg_color=char_bg_color, code=block.code)
                         if self.options['ShowLineNumbers']:
-                            self.show_line_numbers(code_block, True, charcolor=lineno_color, isplaintext=True)
+                            self.show_line_numbers(code_block, True, charcolor=lineno_color, isplaintext=True,
+                                                   code=block.code)
                         # save options as user defined attribute
-                        self.tagcodeblock(code_block, lexer.name)
-                        controller.ViewCursor.collapseToEnd()
+                        self.tagcodeblock(code_block, lexer.name, block.code)
                     finally:
                         try:
                             self.undomanager.leaveUndoContext()
@@ -951,13 +1860,16 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             elif code_block.ImplementationName == "SwXTextFrame":
                 logger.debug("Dealing with a text frame")
                 code_block = code_block
+                block = BlockSnapshot(code_block, code)
 
                 if updatecode:
                     # Frame's UserDefinedAttributes can't be reverted with undo manager -> using text cursor instead
                     udas = code_block.UserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        options = literal_eval(udas.getByName(SNIPPETTAGID).Value)
+                        options = self.getsnippetoptions(udas)
                         self.options.update(options)
+                        if self.isuptodate(code_block, udas, block.code):
+                            return True
                     else:
                         hascode = False
 
@@ -969,26 +1881,23 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     if self.options['ShowLineNumbers']:
                         _style = style.style_for_token(("Comment",))
                         lineno_color = self.to_int(_style['color'])
-                    lexer = self.getlexer(code_block)
+                    lexer = self.getlexer(code_block, block.code)
 
                     hascode = True
-                    cursor = code_block.createTextCursorByRange(code_block)
-                    # lexer = self.getlexer(cursor)
                     self.undomanager.enterUndoContext(f"code highlight (lang: {lexer.name}, style: {stylename})")
-                    self.show_line_numbers(code_block, False)
+                    if self.show_line_numbers(code_block, False, code=block.code):
+                        block.refresh()
                     cursor = code_block.createTextCursorByRange(code_block)
                     try:
                         # code_block.BackColor = -1
                         if bg_color:
                             code_block.BackColor = self.to_int(bg_color)
                         cursor.CharLocale = self.nolocale
-                        self.highlight_code(cursor, lexer, style)
+                        self.highlight_code(cursor, lexer, style, code=block.code)
                         if self.options['ShowLineNumbers']:
-                            self.show_line_numbers(code_block, True, charcolor=lineno_color)
+                            self.show_line_numbers(code_block, True, charcolor=lineno_color, code=block.code)
                         # save options as user defined attribute
-                        cursor = code_block.createTextCursorByRange(code_block)
-                        self.tagcodeblock(code_block, lexer.name)
-                        controller.select(code_block)
+                        self.tagcodeblock(code_block, lexer.name, block.code)
                     finally:
                         self.undomanager.leaveUndoContext()
 
@@ -997,11 +1906,14 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 logger.debug("Dealing with a text table cell.")
                 code_block = code_block
                 hascode = True
+                block = BlockSnapshot(code_block, code)
                 if updatecode:
                     udas = code_block.UserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        options = literal_eval(udas.getByName(SNIPPETTAGID).Value)
+                        options = self.getsnippetoptions(udas)
                         self.options.update(options)
+                        if self.isuptodate(code_block, udas, block.code):
+                            return True
                     else:
                         hascode = False
 
@@ -1013,25 +1925,22 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     if self.options['ShowLineNumbers']:
                         _style = style.style_for_token(("Comment",))
                         lineno_color = self.to_int(_style['color'])
-                    lexer = self.getlexer(code_block)
+                    lexer = self.getlexer(code_block, block.code)
 
                     self.undomanager.enterUndoContext(f"code highlight (lang: {lexer.name}, style: {stylename})")
-                    self.show_line_numbers(code_block, False)
+                    if self.show_line_numbers(code_block, False, code=block.code):
+                        block.refresh()
                     try:
                         # code_block.BackColor = -1
                         if bg_color:
                             code_block.BackColor = self.to_int(bg_color)
                         cursor = code_block.createTextCursorByRange(code_block)
                         cursor.CharLocale = self.nolocale
-                        self.highlight_code(cursor, lexer, style)
+                        self.highlight_code(cursor, lexer, style, code=block.code)
                         if self.options['ShowLineNumbers']:
-                            self.show_line_numbers(code_block, True, charcolor=lineno_color)
+                            self.show_line_numbers(code_block, True, charcolor=lineno_color, code=block.code)
                         # save options as user defined attribute
-                        self.tagcodeblock(code_block, lexer.name)
-                        try:
-                            controller.ViewCursor.collapseToEnd()
-                        except RuntimeException:
-                            pass
+                        self.tagcodeblock(code_block, lexer.name, block.code)
                     finally:
                         self.undomanager.leaveUndoContext()
 
@@ -1041,11 +1950,14 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 logger.debug('Dealing with Calc cell.')
                 hascode = True
                 code_block = code_block
+                block = BlockSnapshot(code_block, code)
                 if updatecode:
                     udas = code_block.UserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        options = literal_eval(udas.getByName(SNIPPETTAGID).Value)
+                        options = self.getsnippetoptions(udas)
                         self.options.update(options)
+                        if self.isuptodate(code_block, udas, block.code):
+                            return True
                     else:
                         hascode = False
 
@@ -1057,21 +1969,24 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     if self.options['ShowLineNumbers']:
                         _style = style.style_for_token(("Comment",))
                         lineno_color = self.to_int(_style['color'])
-                    lexer = self.getlexer(code_block)
+                    lexer = self.getlexer(code_block, block.code)
 
                     self.undomanager.enterUndoContext(f"code highlight (lang: {lexer.name}, style: {stylename})")
-                    self.show_line_numbers(code_block, False)
+                    if self.show_line_numbers(code_block, False, code=block.code):
+                        block.refresh()
                     try:
                         # code_block.CellBackColor = -1
                         code_block.CharLocale = self.nolocale
                         if bg_color:
                             code_block.CellBackColor = self.to_int(bg_color)
                         cursor = code_block.createTextCursor()
-                        self.highlight_code(cursor, lexer, style, char_bg_color=bg_color, checkunicode=True)
+                        self.highlight_code(cursor, lexer, style, char_bg_color=bg_color, code=block.code,
+                                            checkunicode=True)
                         if self.options['ShowLineNumbers']:
-                            self.show_line_numbers(code_block, True, charcolor=lineno_color, char_bg_color=bg_color)
+                            self.show_line_numbers(code_block, True, charcolor=lineno_color, char_bg_color=bg_color,
+                                                   code=block.code)
                         # save options as user defined attribute
-                        self.tagcodeblock(code_block, lexer.name)
+                        self.tagcodeblock(code_block, lexer.name, block.code)
                     finally:
                         self.undomanager.leaveUndoContext()
 
@@ -1084,75 +1999,146 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             self.msgbox(traceback.format_exc())
             logger.exception("")
         finally:
-            if self.doc.hasControllersLocked():
+            if not self.inbatch and self.doc.hasControllersLocked():
                 self.doc.unlockControllers()
                 logger.debug("Controllers unlocked.")
 
-    def highlight_code(self, cursor, lexer, style, char_bg_color=None, checkunicode=False):
-        def _highlight_code():
-            cursor.goRight(len_(lastval), True)  # selects the token's text
-            try:
-                if self.options["UseCharStyles"]:
-                    cursor.CharStyleName = str(lasttype).replace('Token', styleprefix)
-                else:
-                    tok_style = style.style_for_token(lasttype)
-                    properties = ['CharColor', 'CharWeight', 'CharPosture', 'CharUnderline']
-                    values = [self.to_int(tok_style['color']),
-                              W_BOLD if tok_style['bold'] else W_NORMAL,
-                              SL_ITALIC if tok_style['italic'] else SL_NONE,
-                              UL_SINGLE if tok_style['underline'] else UL_NONE]
-                    if tok_style["bgcolor"]:
-                        properties.append('CharBackColor')
-                        values.append(self.to_int(tok_style["bgcolor"]))
-                    elif char_bg_color:
-                        properties.append('CharBackColor')
-                        values.append(self.to_int(char_bg_color))
-                    cursor.setPropertyValues(properties, values)
-            except Exception:
-                pass
-            finally:
-                cursor.collapseToEnd()  # deselects the selected text
-
-        code = cursor.String
+    def highlight_code(self, cursor, lexer, style, char_bg_color=None, code=None, checkunicode=False):
+        if code is None:
+            code = cursor.String
+        styleprefix = CHARSTYLEID + style.__name__.lower()[:-5]
 
+        logger.debug(f"Starting code block highlighting (lexer: {lexer}, style: {style}).")
         # workaround issue 22 (https://github.com/jmzambon/libreoffice-code-highlighter/issues/22)
-        len_ = len
-        if checkunicode and any(ord(char) >= 0x10000 for char in code):
-            len_ = lambda s: sum(1 if ord(char) < 0x10000 else 2 for char in s)
+        # is handled by the plan: EditEngine cursors (shapes, Calc cells) move by UTF-16 code units,
+        # Writer cursors by code points
+        table = get_table(style, char_bg_color, styleprefix if self.options["UseCharStyles"] else None)
+        plan = build_plan(lexer.get_tokens(code), table.resolve, wskey=table.wskeys.get, utf16=checkunicode)
+        logger.debug(f"Highlight plan: {len(plan)} spans, {len(plan.props)} property sets.")
+        unoplan = [self.unoprops(props) for props in plan.props]
 
         # clean up any previous formatting
         cursor.setPropertyValues(("CharBackColor", "CharColor", "CharPosture", "CharUnderline", "CharWeight"),
                                  (-1, -1, SL_NONE, UL_NONE, W_NORMAL))
         if self.charstylesavailable and self.options["UseCharStyles"]:
             cursor.setPropertiesToDefault(("CharStyleName", "CharStyleNames"))
-        cursor.collapseToStart()
 
-        # create character styles if requested
+        # create character styles if requested, only for the token types in use
         # (this happens here to stay synched with undo context)
-        styleprefix = CHARSTYLEID + style.__name__.lower()[:-5]
+        used = {plan.props[propid] for _, _, propid in plan.spans}
         if self.options["UseCharStyles"]:
-            self.createcharstyles(style, styleprefix)
-        # caching consecutive tokens with same token type
-        logger.debug(f"Starting code block highlighting (lexer: {lexer}, style: {style}).")
-        lastval = ''
-        lasttype = None
-        for tok_type, tok_value in lexer.get_tokens(code):
-            if tok_type == lasttype:
-                lastval += tok_value
-            else:
-                if lastval:
-                    _highlight_code()
-                lastval = tok_value
-                lasttype = tok_type
-        # emptying buffer
-        if lastval.strip():
-            _highlight_code()
-        self.cleancharstyles(styleprefix)
+            self.createcharstyles(style, styleprefix, [table.ttypes[props] for props in used])
+
+        self.apply_plan(cursor, plan, unoplan, code, checkunicode)
+        inuse = {props[0] for props in used} if self.options["UseCharStyles"] else set()
+        if self.inbatch:
+            # cleaned once, when the batch ends
+            self.batchcharstyles = (self.batchcharstyles or set()) | inuse
+        else:
+            self.cleancharstyles(inuse)
         logger.debug("Terminating code block highlighting.")
 
-    def show_line_numbers(self, code_block, show, charcolor=-1, isplaintext=False, char_bg_color=None):
-        if self.inlinesnippet:
+    def unoprops(self, props):
+        '''Convert a property tuple into ready-made UNO property names and values.'''
+
+        try:
+            return UNOPROPS[props]
+        except KeyError:
+            pass
+        if len(props) == 1:
+            unoprops = ('CharStyleName',), props
+        else:
+            color, bold, italic, underline, bgcolor = props
+            properties = ('CharColor', 'CharWeight', 'CharPosture', 'CharUnderline')
+            values = (color,
+                      W_BOLD if bold else W_NORMAL,
+                      SL_ITALIC if italic else SL_NONE,
+                      UL_SINGLE if underline else UL_NONE)
+            if bgcolor is not None:
+                properties += ('CharBackColor',)
+                values += (bgcolor,)
+            unoprops = properties, values
+        UNOPROPS[props] = unoprops
+        return unoprops
+
+    def apply_plan(self, cursor, plan, unoplan, code, checkunicode=False):
+        '''
+        Apply a highlight plan to the text selected by cursor.
+        The dominant properties are set once on the whole block, then every other span
+        is reached from the start of its own paragraph, so that a failing span
+        can not shift the following ones.
+        code: text selected by cursor, the plan was built from
+        checkunicode: plan is counted in UTF-16 code units (shapes and Calc cells)
+        '''
+
+        base = plan.dominant()
+        if base is not None:
+            try:
+                cursor.setPropertyValues(*unoplan[base])
+            except Exception:
+                base = None
+
+        try:
+            paras = cursor.createEnumeration()
+        except AttributeError:
+            # cursors inside shapes and Calc cells always span the whole text
+            paras = cursor.Text.createEnumeration()
+        paras = [para for para in paras if para.supportsService('com.sun.star.text.Paragraph')]
+        if not paras:
+            return
+        anchors = [para.Start for para in paras]
+        # first paragraph could begin before an inline snippet
+        anchors[0] = cursor.Start
+        # paragraph lengths are taken from the code, as lexers see it,
+        # unless line breaks inside paragraphs make lines and paragraphs differ
+        lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        if len(lines) != len(paras):
+            lines = [para.String for para in paras]
+        len_ = utf16_len if checkunicode else len
+        starts = []
+        pos = 0
+        for line in lines:
+            starts.append(pos)
+            pos += len_(line) + 1
+
+        for start, length, propid in plan.styled_spans(skip=base):
+            index, offset = locate(starts, start)
+            try:
+                cursor.gotoRange(anchors[index], False)
+                if offset:
+                    cursor.goRight(offset, False)
+                cursor.goRight(length, True)  # selects the span's text
+                cursor.setPropertyValues(*unoplan[propid])
+            except Exception:
+                logger.debug(f"Span ({start}, {length}) could not be formatted.")
+        cursor.collapseToEnd()
+
+    def setparabackcolor(self, cursor, color):
+        '''Set the background color of the paragraphs covered by cursor, through the model only.'''
+
+        # ParaBackColor is ignored by recent versions once paragraph fill attributes are used,
+        # see https://bugs.documentfoundation.org/show_bug.cgi?id=99125
+        try:
+            cursor.setPropertyValues(("FillStyle", "FillColor"), (FS_SOLID, color))
             return
+        except Exception:
+            logger.debug("Paragraph fill properties not available, falling back on ParaBackColor.")
+        try:
+            cursor.ParaBackColor = color
+        except Exception:
+            # last resort for old versions: the dispatcher, which needs the view selection
+            self.doc.CurrentController.select(cursor)
+            prop = PropertyValue(Name="BackgroundColor", Value=color)
+            self.dispatcher.executeDispatch(self.frame, ".uno:BackgroundColor", "", 0, (prop,))
+
+    def show_line_numbers(self, code_block, show, charcolor=-1, isplaintext=False, char_bg_color=None, code=None):
+        '''
+        Show or hide line numbers of code_block, whose text may be given as code.
+        Return True if the text has been modified.
+        '''
+
+        if self.inlinesnippet:
+            return False
         startnb = self.options["LineNumberStart"]
         ratio = self.options["LineNumberRatio"]
         sep = self.options["LineNumberSeparator"]
@@ -1168,10 +2154,12 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
 
         if isplaintext:
             c = code_block.Text.createTextCursorByRange(code_block)
-            code = c.String
+            if code is None:
+                code = c.String
         else:
             c = code_block.Text.createTextCursor()
-            code = c.Text.String
+            if code is None:
+                code = c.Text.String
 
         def show_numbering():
             nblines = len(code.split('\n'))
@@ -1203,6 +2191,7 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             logger.debug("Showing code block numbering.")
             bg_color = self.to_int(char_bg_color) or -1
             show_numbering()
+            return True
         else:
             # check for existing line numbering and its width
             regexstring = getregexstring()
@@ -1219,12 +2208,16 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             if lenno:
                 logger.debug("Hiding code block numbering.")
                 hide_numbering()
+                return True
+            return False
 
-    def checkinlinesnippet(self, code_block):
+    def checkinlinesnippet(self, code_block, code=None):
         self.inlinesnippet = False
         c = code_block.Text.createTextCursorByRange(code_block)
-        if code_block.String:
-            lines = code_block.String.splitlines()
+        if code is None:
+            code = code_block.String
+        if code:
+            lines = code.splitlines()
             if len(lines) == 1:  # this condition prevents to treat lines separated by carriage returns as a single line
                 if c.Start.TextParagraph == c.End.TextParagraph:
                     if c.Text.compareRegionStarts(c, c.Start.TextParagraph) != 0:
@@ -1236,13 +2229,14 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             if udas and SNIPPETTAGID in udas:
                 self.inlinesnippet = True
 
-    def ensure_paragraphs(self, selected_code):
+    def ensure_paragraphs(self, selected_code, code=None):
         '''Ensure the selection does not contains part of paragraphs.
         Cursor could start or end in the middle of a code line, when plain text selected.
-        So let's expand it to the entire paragraphs.'''
+        So let's expand it to the entire paragraphs.
+        code: text of selected_code, if already known'''
 
         c = selected_code.Text.createTextCursorByRange(selected_code)
-        if selected_code.String:
+        if selected_code.String if code is None else code:
             if self.inlinesnippet:
                 # inline snippet, abort expansion
                 return c
@@ -1251,16 +2245,20 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             c.gotoRange(selected_code.End, True)
             c.gotoEndOfParagraph(True)
         else:
+            # the snippet bookmark gives the extent at once, probing only checks its edges
+            # (and remains the way for legacy snippets)
             if self.inlinesnippet:
                 udas = selected_code.TextUserDefinedAttributes
                 if SNIPPETTAGID in udas:
                     options = udas.getByName(SNIPPETTAGID).Value
+                    bounds = self.snippetbookmark(selected_code, options) or selected_code
+                    c.gotoRange(bounds.Start, False)
                     while c.goLeft(1, False):
                         udas2 = c.TextUserDefinedAttributes
                         if not (udas2 and SNIPPETTAGID in udas2 and udas2.getByName(SNIPPETTAGID).Value == options):
                             break
 
-                    c.gotoRange(selected_code, True)
+                    c.gotoRange(bounds.End, True)
                     while c.goRight(1, True):
                         udas2 = c.TextUserDefinedAttributes
                         if not (udas2 and SNIPPETTAGID in udas2 and udas2.getByName(SNIPPETTAGID).Value == options):
@@ -1270,8 +2268,9 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 udas = selected_code.ParaUserDefinedAttributes
                 if SNIPPETTAGID in udas:
                     options = udas.getByName(SNIPPETTAGID).Value
+                    bounds = self.snippetbookmark(selected_code, options) or selected_code
+                    c.gotoRange(bounds.Start, False)
                     startpara = c.TextParagraph
-                    endpara = c.TextParagraph
                     while c.gotoPreviousParagraph(False):
                         udas2 = c.ParaUserDefinedAttributes
                         if (udas2 and SNIPPETTAGID in udas2 and udas2.getByName(SNIPPETTAGID).Value == options):
@@ -1279,7 +2278,8 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         else:
                             break
 
-                    c.gotoRange(selected_code, False)
+                    c.gotoRange(bounds.End, False)
+                    endpara = c.TextParagraph
                     while c.gotoNextParagraph(False):
                         udas2 = c.ParaUserDefinedAttributes
                         if (udas2 and SNIPPETTAGID in udas2 and udas2.getByName(SNIPPETTAGID).Value == options):
@@ -1321,6 +2321,37 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
             else:
                 return cursor
 
+        def search_all_paras(stylename):
+            # native search returns the paragraphs of the style in bulk,
+            # contiguous ones are merged into code blocks
+            displayname = self.doc.StyleFamilies.ParagraphStyles.getByName(stylename).DisplayName
+            desc = self.doc.createSearchDescriptor()
+            desc.SearchStyles = True
+            desc.SearchString = displayname
+            found = self.doc.findAll(desc)
+            cursor = None
+            for i in range(found.Count):
+                hit = found.getByIndex(i)
+                if cursor is not None and is_next_para(cursor, hit, stylename):
+                    cursor.gotoRange(hit.End, True)
+                else:
+                    cursor = hit.Text.createTextCursorByRange(hit)
+                    code_blocks.append(cursor)
+
+        def is_next_para(cursor, hit, stylename):
+            # hit follows cursor, with only paragraphs of the same style in between
+            # (like empty ones, that search may not report)
+            if cursor.Text != hit.Text:
+                return False
+            c = cursor.Text.createTextCursorByRange(cursor.End)
+            while c.gotoNextParagraph(False):
+                order = c.Text.compareRegionStarts(c, hit)
+                if order == 0:
+                    return True
+                if order < 0 or c.ParaStyleName != stylename:
+                    return False
+            return False
+
         def browse_all_paras(container=None):
             isroot = None
             if not container:
@@ -1355,27 +2386,31 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         browse_all_paras(cell)
 
         code_blocks = []
-        browse_all_paras()
+        try:
+            search_all_paras(SELECTED_PARASTYLE[self.doc.RuntimeUID])
+        except Exception:
+            logger.exception("Paragraph style search failed, browsing all paragraphs instead.")
+            code_blocks.clear()
+            browse_all_paras()
         if code_blocks:
-            sel = self.doc.CurrentSelection
-            for code_block in code_blocks:
-                self.prepare_highlight(finish_code_block(code_block))
+            with self.batchscope(f"Highlight all: {len(code_blocks)} snippets"):
+                for code_block in code_blocks:
+                    self.prepare_highlight(finish_code_block(code_block))
             message = ngettext("{} code snippet has been formatted.",
                                "{} code snippets have been formatted.",
                                len(code_blocks))
-            self.doc.CurrentController.select(sel)
             self.msgbox(message.format(len(code_blocks)), boxtype=INFOBOX, title=_("Highlight all"))
 
-    def update_all(self, usetags):
-        '''Update all formatted code in the active document.
-        DO NOT PUBLISH, ALPHA VERSION'''
-        def highlight_snippet(code_block, udas):
-            if usetags:
-                options = literal_eval(udas.getByName(SNIPPETTAGID).Value)
-                self.options.update(options)
-            self.doc.CurrentController.select(code_block)
-            logger.debug(f'Updating snippet (type: {code_block.ImplementationName})')
-            self.prepare_highlight(code_block)
+    def findtaggedsnippets(self):
+        '''
+        Return the snippets of the active document tagged with their options,
+        as a list of (code block, user defined attributes, character styles availability).
+        Snippets are taken from the registry when it is complete, otherwise the document
+        is browsed, and the registry is considered complete once they have all been tagged again
+        or found registered.
+        '''
+        def addsnippet(code_block, udas):
+            snippets.append((code_block, udas, self.charstylesavailable))
 
         def browsetaggedcode_text(container=None):
             root = False
@@ -1385,42 +2420,44 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 root = True
             cursor = None
             options = None
+            tag = None
             for para in container:
                 if not para.supportsService('com.sun.star.text.Paragraph'):
                     continue
                 udas = para.ParaUserDefinedAttributes
                 if udas is None:
                     continue
-                if SNIPPETTAGID in udas and not cursor:
-                    options = udas
-                    cursor = container.createTextCursorByRange(para.Start)
-                elif cursor and SNIPPETTAGID not in udas:
+                paratag = udas.getByName(SNIPPETTAGID).Value if SNIPPETTAGID in udas else None
+                # adjacent snippets have different tags
+                if cursor and paratag != tag:
                     cursor.gotoRange(para.Start, True)
                     cursor.goLeft(1, True)
-                    highlight_snippet(cursor, options)
+                    addsnippet(cursor, options)
                     cursor, options = None, None
+                if paratag and not cursor:
+                    options, tag = udas, paratag
+                    cursor = container.createTextCursorByRange(para.Start)
             # last paragraph could be part of a code block
-            if cursor and SNIPPETTAGID in udas:
+            if cursor:
                 cursor.gotoRange(para.End, True)
-                highlight_snippet(cursor, udas)
+                addsnippet(cursor, options)
 
             if root:
                 for frame in self.doc.TextFrames:
                     self.charstylesavailable = True
                     udas = frame.UserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        highlight_snippet(frame, udas)
+                        addsnippet(frame, udas)
                     else:
                         browsetaggedcode_text(frame)
                 for table in self.doc.TextTables:
-                    self.doc.CurrentController.select(table)
                     self.charstylesavailable = True
                     cellnames = table.CellNames
                     for cellname in cellnames:
                         cell = table.getCellByName(cellname)
                         udas = cell.UserDefinedAttributes
                         if udas and SNIPPETTAGID in udas:
-                            highlight_snippet(cell, udas)
+                            addsnippet(cell, udas)
                         else:
                             browsetaggedcode_text(cell)
                 for shape in self.doc.DrawPage:
@@ -1428,14 +2465,14 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         udas = shape.UserDefinedAttributes
                         if udas and SNIPPETTAGID in udas:
                             self.charstylesavailable = False
-                            highlight_snippet(shape, udas)
+                            addsnippet(shape, udas)
 
         def browsetaggedcode_calc():
             for sheet in self.doc.Sheets:
                 for ranges in sheet.UniqueCellFormatRanges:
                     udas = ranges.UserDefinedAttributes
                     if udas and SNIPPETTAGID in udas:
-                        highlight_snippet(ranges, udas)
+                        addsnippet(ranges, udas)
 
         def browsetaggedcode_draw():
             for drawpage in self.doc.DrawPages:
@@ -1444,26 +2481,119 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         udas = shape.UserDefinedAttributes
                         if udas and SNIPPETTAGID in udas:
                             self.charstylesavailable = False
-                            highlight_snippet(shape, udas)
+                            addsnippet(shape, udas)
                     except AttributeError:
                         continue
 
+        snippets = []
+        registry = self.registry
+        if registry.trusted():
+            logger.debug("Tagged snippets taken from registry.")
+            charstylesavailable = self.charstylesavailable
+            for _, code_block, kind in registry.entries():
+                udas, _ = getsnippetudas(code_block)
+                snippets.append((code_block, udas, charstylesavailable if kind == 'calc' else kind != 'shape'))
+            if registry.complete:
+                return snippets
+            # some snippets have been moved or deleted: browse the document instead
+            snippets.clear()
+
+        if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
+            browsetaggedcode_text()
+        elif self.doc.supportsService('com.sun.star.sheet.SpreadsheetDocument'):
+            browsetaggedcode_calc()
+        elif self.doc.supportsService('com.sun.star.drawing.GenericDrawingDocument'):
+            browsetaggedcode_draw()
+        # callers tag every snippet again, which registers them, or check that it is registered
+        registry.markcomplete()
+        return snippets
+
+    def update_all(self, usetags, force=False):
+        '''Update all formatted code in the active document.
+        Snippets unchanged since they were highlighted are skipped, unless <force> is set.
+        DO NOT PUBLISH, ALPHA VERSION'''
+
         logger.debug("Updating all snippets previously formatted with Code Highlighter 2.")
-        sel = self.doc.CurrentSelection
-        try:
-            if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
-                browsetaggedcode_text()
-            elif self.doc.supportsService('com.sun.star.sheet.SpreadsheetDocument'):
-                browsetaggedcode_calc()
-            elif self.doc.supportsService('com.sun.star.drawing.GenericDrawingDocument'):
-                browsetaggedcode_draw()
-            self.msgbox("Done.")
-        finally:
-            self.doc.CurrentController.select(sel)
+        self.force = force
+        skipped = 0
+        # snippets are collected first, then highlighted in a single batch
+        snippets = self.findtaggedsnippets()
+        with self.batchscope(f"Highlight all: {len(snippets)} snippets"):
+            for code_block, udas, self.charstylesavailable in snippets:
+                if usetags:
+                    options = self.getsnippetoptions(udas)
+                    self.options.update(options)
+                code = getattr(code_block, 'String', None)     # Calc cell ranges have no text of their own
+                # skipped snippets are not tagged again, so they must be registered already
+                # (copies and snippets dropped from the registry are highlighted again)
+                if self.isuptodate(code_block, udas, code) and self.isregistered(code_block, udas):
+                    skipped += 1
+                    continue
+                logger.debug(f'Updating snippet (type: {code_block.ImplementationName})')
+                self.prepare_highlight(code_block, code=code)
+        logger.debug(f"{skipped} unchanged snippets skipped.")
+        self.msgbox("Done.")
+
+    def retheme(self, stylename):
+        '''
+        Switch all tagged snippets of the active document to another Pygments style.
+        Snippets formatted with character styles are rethemed by redefining these styles
+        and updating their backgrounds and tags, without lexing. Others are highlighted again.
+        Return the number of snippets rethemed without lexing.
+        '''
+
+        style = self.getstylebyname(stylename)
+        styleprefix = CHARSTYLEID + style.__name__.lower()[:-5]
+        bg_color = self.to_int(style.background_color)
+        snippets = self.findtaggedsnippets()
+        oldprefixes = set()
+        rethemed = []
+        rehighlight = []
+        with self.batchscope(f"Retheme: {len(snippets)} snippets"):
+            for snippet in snippets:
+                code_block, udas, charstylesavailable = snippet
+                options = self.getsnippetoptions(udas)
+                # line numbers, text shapes and Calc cells are formatted directly
+                if (not charstylesavailable or not options.get('UseCharStyles') or options.get('ShowLineNumbers')
+                        or code_block.ImplementationName not in ("SwXTextCursor", "SwXTextFrame", "SwXCell")):
+                    rehighlight.append(snippet)
+                    continue
+                try:
+                    oldstyle = self.getstylebyname(options['Style'])
+                except Exception:
+                    rehighlight.append(snippet)
+                    continue
+                oldprefixes.add(CHARSTYLEID + oldstyle.__name__.lower()[:-5])
+                options['Style'] = stylename
+                if code_block.ImplementationName == "SwXTextCursor":
+                    self.checkinlinesnippet(code_block)
+                else:
+                    self.inlinesnippet = False
+                # inline snippets have no background of their own with character styles
+                if options['ColourizeBackground'] and not self.inlinesnippet:
+                    if code_block.ImplementationName == "SwXTextCursor":
+                        self.setparabackcolor(code_block, bg_color)
+                    else:
+                        code_block.BackColor = bg_color
+                self.options.update(options)
+                self.tagcodeblock(code_block, options['Language'])
+                rethemed.append(code_block)
+            redefined = self.redefinecharstyles(style, styleprefix, oldprefixes, rethemed)
+            logger.debug(f"{redefined} character styles redefined with {stylename} style.")
+
+            for code_block, udas, self.charstylesavailable in rehighlight:
+                options = self.getsnippetoptions(udas)
+                options['Style'] = stylename
+                self.options.update(options)
+                logger.debug(f'Highlighting snippet again (type: {code_block.ImplementationName})')
+                self.prepare_highlight(code_block)
+        return len(snippets) - len(rehighlight)
 
     def removealltags(self):
         '''
         Remove all snippet tags in the active document.
+        Registered snippets are untagged directly when the registry can be trusted,
+        otherwise the whole document is browsed.
         TODO:
         - progress bar
         - selection only
@@ -1482,11 +2612,9 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     if not para.supportsService('com.sun.star.text.Paragraph'):
                         continue
                     udas2 = para.ParaUserDefinedAttributes
-                    if SNIPPETTAGID in udas2:
-                        udas2.removeByName(SNIPPETTAGID)
+                    if self.untag(udas2):
                         para.ParaUserDefinedAttributes = udas2
-            elif SNIPPETTAGID in udas:
-                udas.removeByName(SNIPPETTAGID)
+            elif self.untag(udas):
                 c.ParaUserDefinedAttributes = udas
 
             # search for TextUserDefinedAttributes
@@ -1500,22 +2628,18 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                         for portion in para:
                             if portion.TextPortionType == "Text":
                                 udas3 = portion.TextUserDefinedAttributes
-                                if SNIPPETTAGID in udas3:
-                                    udas3.removeByName(SNIPPETTAGID)
+                                if self.untag(udas3):
                                     portion.TextUserDefinedAttributes = udas3
-                    elif SNIPPETTAGID in udas2:
-                        udas2.removeByName(SNIPPETTAGID)
+                    elif self.untag(udas2):
                         para.TextUserDefinedAttributes = udas2
-            elif SNIPPETTAGID in udas:
-                udas.removeByName(SNIPPETTAGID)
+            elif self.untag(udas):
                 c.TextUserDefinedAttributes = udas
 
             # search for UserDefinedAttributes and for subtexts
             if root:
                 for frame in self.doc.TextFrames:
                     udas = frame.UserDefinedAttributes
-                    if SNIPPETTAGID in udas:
-                        udas.removeByName(SNIPPETTAGID)
+                    if self.untag(udas):
                         frame.UserDefinedAttributes = udas
                     searchforlexertag_text(frame)
                 for table in self.doc.TextTables:
@@ -1523,22 +2647,19 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                     for cellname in cellnames:
                         cell = table.getCellByName(cellname)
                         udas = cell.UserDefinedAttributes
-                        if SNIPPETTAGID in udas:
-                            udas.removeByName(SNIPPETTAGID)
+                        if self.untag(udas):
                             cell.UserDefinedAttributes = udas
                         searchforlexertag_text(cell)
                 for shape in self.doc.DrawPage:
                     udas = shape.UserDefinedAttributes
-                    if SNIPPETTAGID in udas:
-                        udas.removeByName(SNIPPETTAGID)
+                    if self.untag(udas):
                         shape.UserDefinedAttributes = udas
 
         def searchforlexertag_calc():
             for sheet in self.doc.Sheets:
                 for ranges in sheet.UniqueCellFormatRanges:
                     udas = ranges.UserDefinedAttributes
-                    if SNIPPETTAGID in udas:
-                        udas.removeByName(SNIPPETTAGID)
+                    if self.untag(udas):
                         ranges.UserDefinedAttributes = udas
 
         def searchforlexertag_draw():
@@ -1546,8 +2667,7 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 for shape in drawpage:
                     try:
                         udas = shape.UserDefinedAttributes
-                        if SNIPPETTAGID in udas:
-                            udas.removeByName(SNIPPETTAGID)
+                        if self.untag(udas):
                             shape.UserDefinedAttributes = udas
                     except AttributeError:
                         continue
@@ -1555,7 +2675,20 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
         self.doc.lockControllers()
         self.undomanager.enterUndoContext("All CH2 attributes removed.")
         try:
-            if self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
+            registry = self.registry
+            untagged = False
+            if registry.trusted():
+                logger.debug("Tagged snippets taken from registry.")
+                for _, code_block, _ in registry.entries():
+                    udas, propname = getsnippetudas(code_block)
+                    if self.untag(udas):
+                        setattr(code_block, propname, udas)
+                # entries() marks the registry incomplete if snippets have been moved or deleted
+                untagged = registry.complete
+            # the whole document is browsed when some snippets may not be registered
+            if untagged:
+                self.msgbox("Done.")
+            elif self.doc.supportsService('com.sun.star.text.GenericTextDocument'):
                 searchforlexertag_text()
                 self.msgbox("Done.")
             elif self.doc.supportsService('com.sun.star.sheet.SpreadsheetDocument'):
@@ -1566,6 +2699,7 @@ class CodeHighlighter(unohelper.Base, XJobExecutor, XDialogEventHandler):
                 self.msgbox("Done.")
             else:
                 self.msgbox("Module not yet supported.")
+            registry.clear()
         finally:
             self.undomanager.leaveUndoContext()
             self.doc.unlockControllers()
@@ -1619,3 +2753,15 @@ def update_all_from_options(event=None):
     ctx = XSCRIPTCONTEXT.getComponentContext()
     highlighter = CodeHighlighter(ctx)
     highlighter.update_all(False)
+
+
+def force_update_all_from_tags(event=None):
+    ctx = XSCRIPTCONTEXT.getComponentContext()
+    highlighter = CodeHighlighter(ctx)
+    highlighter.update_all(True, force=True)
+
+
+def retheme_all(event=None):
+    ctx = XSCRIPTCONTEXT.getComponentContext()
+    highlighter = CodeHighlighter(ctx)
+    highlighter.do_retheme()
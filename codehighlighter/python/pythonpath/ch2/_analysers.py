@@ -0,0 +1,190 @@
+# Automatically generated by ch2/detect.py.
+# DO NOT EDIT BY HAND; run `python -m ch2.detect` from the pythonpath folder instead.
+
+PYGMENTS_VERSION = '2.18.0'
+
+# (module name, class name, (check, argument) signal or None), in Pygments iteration order
+ANALYSERS = (
+    ('pygments.lexers.actionscript', 'ActionScript3Lexer', None),
+    ('pygments.lexers.actionscript', 'ActionScriptLexer', None),
+    ('pygments.lexers.parsers', 'AntlrActionScriptLexer', None),
+    ('pygments.lexers.parsers', 'AntlrCSharpLexer', None),
+    ('pygments.lexers.parsers', 'AntlrCppLexer', None),
+    ('pygments.lexers.parsers', 'AntlrJavaLexer', None),
+    ('pygments.lexers.parsers', 'AntlrLexer', None),
+    ('pygments.lexers.parsers', 'AntlrObjectiveCLexer', None),
+    ('pygments.lexers.parsers', 'AntlrPerlLexer', None),
+    ('pygments.lexers.parsers', 'AntlrPythonLexer', None),
+    ('pygments.lexers.parsers', 'AntlrRubyLexer', None),
+    ('pygments.lexers.c_like', 'ArduinoLexer', None),
+    ('pygments.lexers.asc', 'AscLexer', None),
+    ('pygments.lexers.basic', 'BBCBasicLexer', None),
+    ('pygments.lexers.shell', 'BashLexer', None),
+    ('pygments.lexers.bdd', 'BddLexer', None),
+    ('pygments.lexers.esoteric', 'BrainfuckLexer', None),
+    ('pygments.lexers.modeling', 'BugsLexer', None),
+    ('pygments.lexers.c_cpp', 'CLexer', None),
+    ('pygments.lexers.make', 'CMakeLexer', None),
+    ('pygments.lexers.dotnet', 'CSharpAspxLexer', None),
+    ('pygments.lexers.asm', 'Ca65Lexer', None),
+    ('pygments.lexers.carbon', 'CarbonLexer', None),
+    ('pygments.lexers.basic', 'CbmBasicV2Lexer', None),
+    ('pygments.lexers.c_like', 'CharmciLexer', None),
+    ('pygments.lexers.lisp', 'CommonLispLexer', None),
+    ('pygments.lexers.oberon', 'ComponentPascalLexer', None),
+    ('pygments.lexers.theorem', 'CoqLexer', None),
+    ('pygments.lexers.cplint', 'CplintLexer', None),
+    ('pygments.lexers.c_cpp', 'CppLexer', None),
+    ('pygments.lexers.templates', 'CssDjangoLexer', None),
+    ('pygments.lexers.templates', 'CssErbLexer', None),
+    ('pygments.lexers.templates', 'CssGenshiLexer', None),
+    ('pygments.lexers.templates', 'CssPhpLexer', None),
+    ('pygments.lexers.templates', 'CssSmartyLexer', None),
+    ('pygments.lexers.c_like', 'CudaLexer', None),
+    ('pygments.lexers.configs', 'DesktopLexer', None),
+    ('pygments.lexers.diff', 'DiffLexer', None),
+    ('pygments.lexers.templates', 'DjangoLexer', None),
+    ('pygments.lexers.dns', 'DnsZoneLexer', ('startswith', '$ORIGIN')),
+    ('pygments.lexers.html', 'DtdLexer', None),
+    ('pygments.lexers.ecl', 'ECLLexer', None),
+    ('pygments.lexers.c_like', 'ECLexer', None),
+    ('pygments.lexers.scripting', 'EasytrieveLexer', None),
+    ('pygments.lexers.templates', 'ErbLexer', None),
+    ('pygments.lexers.templates', 'EvoqueHtmlLexer', None),
+    ('pygments.lexers.templates', 'EvoqueLexer', None),
+    ('pygments.lexers.templates', 'EvoqueXmlLexer', None),
+    ('pygments.lexers.shell', 'ExeclineLexer', None),
+    ('pygments.lexers.ezhil', 'EzhilLexer', None),
+    ('pygments.lexers.dotnet', 'FSharpLexer', None),
+    ('pygments.lexers.forth', 'ForthLexer', None),
+    ('pygments.lexers.freefem', 'FreeFemLexer', None),
+    ('pygments.lexers.algebra', 'GAPConsoleLexer', None),
+    ('pygments.lexers.algebra', 'GAPLexer', None),
+    ('pygments.lexers.gdscript', 'GDScriptLexer', None),
+    ('pygments.lexers.asm', 'GasLexer', None),
+    ('pygments.lexers.templates', 'GenshiLexer', None),
+    ('pygments.lexers.testing', 'GherkinLexer', None),
+    ('pygments.lexers.markup', 'GroffLexer', None),
+    ('pygments.lexers.jvm', 'GroovyLexer', ('shebang_matches', 'groovy')),
+    ('pygments.lexers.haxe', 'HaxeLexer', None),
+    ('pygments.lexers.templates', 'HtmlDjangoLexer', None),
+    ('pygments.lexers.templates', 'HtmlGenshiLexer', None),
+    ('pygments.lexers.html', 'HtmlLexer', None),
+    ('pygments.lexers.templates', 'HtmlPhpLexer', None),
+    ('pygments.lexers.templates', 'HtmlSmartyLexer', None),
+    ('pygments.lexers.textfmts', 'HttpLexer', None),
+    ('pygments.lexers.lisp', 'HyLexer', None),
+    ('pygments.lexers.scripting', 'HybrisLexer', None),
+    ('pygments.lexers.idl', 'IDLLexer', None),
+    ('pygments.lexers.int_fiction', 'Inform6Lexer', None),
+    ('pygments.lexers.configs', 'IniLexer', None),
+    ('pygments.lexers.modeling', 'JagsLexer', None),
+    ('pygments.lexers.jvm', 'JasminLexer', None),
+    ('pygments.lexers.templates', 'JavascriptDjangoLexer', None),
+    ('pygments.lexers.templates', 'JavascriptErbLexer', None),
+    ('pygments.lexers.templates', 'JavascriptGenshiLexer', None),
+    ('pygments.lexers.templates', 'JavascriptPhpLexer', None),
+    ('pygments.lexers.templates', 'JavascriptSmartyLexer', None),
+    ('pygments.lexers.scripting', 'JclLexer', None),
+    ('pygments.lexers.templates', 'JspLexer', None),
+    ('pygments.lexers.julia', 'JuliaLexer', ('shebang_matches', 'julia')),
+    ('pygments.lexers.templates', 'LassoCssLexer', None),
+    ('pygments.lexers.templates', 'LassoHtmlLexer', None),
+    ('pygments.lexers.templates', 'LassoJavascriptLexer', None),
+    ('pygments.lexers.javascript', 'LassoLexer', None),
+    ('pygments.lexers.templates', 'LassoXmlLexer', None),
+    ('pygments.lexers.lean', 'Lean3Lexer', None),
+    ('pygments.lexers.lean', 'Lean4Lexer', None),
+    ('pygments.lexers.inferno', 'LimboLexer', None),
+    ('pygments.lexers.objective', 'LogosLexer', None),
+    ('pygments.lexers.prolog', 'LogtalkLexer', None),
+    ('pygments.lexers.make', 'MakefileLexer', None),
+    ('pygments.lexers.templates', 'MasonLexer', None),
+    ('pygments.lexers.matlab', 'MatlabLexer', None),
+    ('pygments.lexers.maxima', 'MaximaLexer', None),
+    ('pygments.lexers.modula2', 'Modula2Lexer', None),
+    ('pygments.lexers.mojo', 'MojoLexer', None),
+    ('pygments.lexers.c_like', 'MqlLexer', None),
+    ('pygments.lexers.sql', 'MySqlLexer', None),
+    ('pygments.lexers.asm', 'NasmLexer', None),
+    ('pygments.lexers.dotnet', 'NemerleLexer', None),
+    ('pygments.lexers.c_like', 'NesCLexer', None),
+    ('pygments.lexers.nix', 'NixLexer', None),
+    ('pygments.lexers.textfmts', 'NotmuchLexer', None),
+    ('pygments.lexers.python', 'NumPyLexer', None),
+    ('pygments.lexers.objective', 'ObjectiveCLexer', None),
+    ('pygments.lexers.objective', 'ObjectiveCppLexer', None),
+    ('pygments.lexers.javascript', 'ObjectiveJLexer', None),
+    ('pygments.lexers.matlab', 'OctaveLexer', None),
+    ('pygments.lexers.c_like', 'OmgIdlLexer', None),
+    ('pygments.lexers.business', 'OpenEdgeLexer', None),
+    ('pygments.lexers.pawn', 'PawnLexer', None),
+    ('pygments.lexers.perl', 'Perl6Lexer', None),
+    ('pygments.lexers.perl', 'PerlLexer', None),
+    ('pygments.lexers.php', 'PhpLexer', None),
+    ('pygments.lexers.c_like', 'PikeLexer', None),
+    ('pygments.lexers.graphics', 'PovrayLexer', None),
+    ('pygments.lexers.prolog', 'PrologLexer', None),
+    ('pygments.lexers.c_like', 'PromelaLexer', None),
+    ('pygments.lexers.python', 'Python2Lexer', ('shebang_matches', 'pythonw?2(\\.\\d)?')),
+    ('pygments.lexers.python', 'PythonLexer', None),
+    ('pygments.lexers.basic', 'QBasicLexer', None),
+    ('pygments.lexers.parsers', 'RagelCLexer', None),
+    ('pygments.lexers.parsers', 'RagelCppLexer', None),
+    ('pygments.lexers.parsers', 'RagelDLexer', None),
+    ('pygments.lexers.parsers', 'RagelEmbeddedLexer', None),
+    ('pygments.lexers.parsers', 'RagelJavaLexer', None),
+    ('pygments.lexers.parsers', 'RagelObjectiveCLexer', None),
+    ('pygments.lexers.parsers', 'RagelRubyLexer', None),
+    ('pygments.lexers.rebol', 'RebolLexer', None),
+    ('pygments.lexers.configs', 'RegeditLexer', ('startswith', 'Windows Registry Editor')),
+    ('pygments.lexers.resource', 'ResourceLexer', None),
+    ('pygments.lexers.scripting', 'RexxLexer', None),
+    ('pygments.lexers.templates', 'RhtmlLexer', None),
+    ('pygments.lexers.dsls', 'RslLexer', None),
+    ('pygments.lexers.markup', 'RstLexer', None),
+    ('pygments.lexers.ruby', 'RubyLexer', ('shebang_matches', 'ruby(1\\.\\d)?')),
+    ('pygments.lexers.r', 'SLexer', None),
+    ('pygments.lexers.scdoc', 'ScdocLexer', None),
+    ('pygments.lexers.matlab', 'ScilabLexer', None),
+    ('pygments.lexers.configs', 'SingularityLexer', None),
+    ('pygments.lexers.shell', 'SlurmBashLexer', None),
+    ('pygments.lexers.dalvik', 'SmaliLexer', None),
+    ('pygments.lexers.templates', 'SmartyLexer', None),
+    ('pygments.lexers.installers', 'SourcesListLexer', None),
+    ('pygments.lexers.templates', 'SqlJinjaLexer', None),
+    ('pygments.lexers.sql', 'SqlLexer', None),
+    ('pygments.lexers.templates', 'SspLexer', None),
+    ('pygments.lexers.modeling', 'StanLexer', None),
+    ('pygments.lexers.supercollider', 'SuperColliderLexer', None),
+    ('pygments.lexers.c_like', 'SwigLexer', None),
+    ('pygments.lexers.configs', 'SystemdLexer', None),
+    ('pygments.lexers.int_fiction', 'Tads3Lexer', None),
+    ('pygments.lexers.tal', 'TalLexer', None),
+    ('pygments.lexers.asm', 'TasmLexer', None),
+    ('pygments.lexers.tcl', 'TclLexer', ('shebang_matches', '(tcl)')),
+    ('pygments.lexers.templates', 'TeaTemplateLexer', None),
+    ('pygments.lexers.teraterm', 'TeraTermLexer', None),
+    ('pygments.lexers.markup', 'TexLexer', None),
+    ('pygments.lexers.special', 'TextLexer', None),
+    ('pygments.lexers.sql', 'TransactSqlLexer', None),
+    ('pygments.lexers.rdf', 'TurtleLexer', None),
+    ('pygments.lexers.unicon', 'UcodeLexer', None),
+    ('pygments.lexers.urbi', 'UrbiscriptLexer', None),
+    ('pygments.lexers.varnish', 'VCLLexer', None),
+    ('pygments.lexers.varnish', 'VCLSnippetLexer', None),
+    ('pygments.lexers.dotnet', 'VbNetAspxLexer', None),
+    ('pygments.lexers.dotnet', 'VbNetLexer', None),
+    ('pygments.lexers.templates', 'VelocityLexer', None),
+    ('pygments.lexers.templates', 'VelocityXmlLexer', None),
+    ('pygments.lexers.hdl', 'VerilogLexer', None),
+    ('pygments.lexers.vip', 'VisualPrologGrammarLexer', None),
+    ('pygments.lexers.vip', 'VisualPrologLexer', None),
+    ('pygments.lexers.wowtoc', 'WoWTocLexer', None),
+    ('pygments.lexers.templates', 'XmlDjangoLexer', None),
+    ('pygments.lexers.templates', 'XmlErbLexer', None),
+    ('pygments.lexers.html', 'XmlLexer', None),
+    ('pygments.lexers.templates', 'XmlPhpLexer', None),
+    ('pygments.lexers.templates', 'XmlSmartyLexer', None),
+    ('pygments.lexers.html', 'XsltLexer', None),
+)
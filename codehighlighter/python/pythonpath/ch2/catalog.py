@@ -0,0 +1,166 @@
+"""
+    ch2.catalog
+    ~~~~~~~~~~~
+
+    Lexer and style catalog used to populate the options dialog.
+
+    The catalog is generated from the Pygments mapping files, so that no lexer
+    module needs to be imported, and is cached on disk, keyed by Pygments and
+    extension versions. Lexers and styles of installed Pygments plugins are
+    added when the catalog is loaded, they are never cached.
+
+    :license: GPL, see LICENSE for details.
+"""
+
+import json
+import logging
+import os.path
+from importlib import import_module
+
+import pygments
+from pygments.lexers._mapping import LEXERS
+from pygments.plugin import find_plugin_lexers, find_plugin_styles
+from pygments.styles._mapping import STYLES
+
+logger = logging.getLogger("codehighlighter")
+
+CATALOG_FORMAT = 3
+CATALOG_FILENAME = "codehighlighter_catalog.json"
+
+# let's add a convenient shortcut to VB.net lexer for LOBasic
+EXTRA_LEXERS = (("LibreOffice Basic", ()),)
+SHORTCUTS = {"libreoffice basic": "VbNetLexer"}
+EXTRA_STYLES = ('libreoffice-classic', 'libreoffice-dark')
+
+
+def stylekey(name):
+    '''Sort key of style names, 'default' first.'''
+
+    return name != 'default', name.casefold()
+
+
+class Catalog:
+    '''
+    Lexer and style names available to the user.
+
+    lexernames: sorted lexer display names (long names)
+    styles: sorted style names, 'default' first
+    index: casefolded alias or long name -> Pygments lexer class name,
+           or "<module>.<class name>" key of a plugin lexer
+    plugins: plugin lexer key -> lexer class
+    '''
+
+    def __init__(self, lexernames, styles, index):
+        self.lexernames = lexernames
+        self.styles = styles
+        self.index = index
+        self.plugins = {}
+
+    def todict(self):
+        return {'lexernames': self.lexernames, 'styles': self.styles, 'index': self.index}
+
+    def addplugins(self, lexerclasses):
+        '''Add plugin lexers, builtin lexers keep their aliases and long names.'''
+
+        lexernames = set(self.lexernames)
+        for lexerclass in lexerclasses:
+            key = f'{lexerclass.__module__}.{lexerclass.__name__}'
+            self.plugins[key] = lexerclass
+            for alias in lexerclass.aliases:
+                self.index.setdefault(alias.casefold(), key)
+            if lexerclass.name:
+                self.index.setdefault(lexerclass.name.casefold(), key)
+                lexernames.add(lexerclass.name)
+        self.lexernames = sorted(lexernames, key=str.casefold)
+
+    def addpluginstyles(self, styles):
+        '''Add plugin styles from (name, style class) pairs.'''
+
+        self.styles = sorted(set(self.styles).union(name for name, _ in styles), key=stylekey)
+
+    def findclassname(self, name):
+        '''Return the class name matching an alias or a long name, or None.'''
+
+        name = name.casefold()
+        classname = self.index.get(name)
+        if classname is None:
+            # long names stored by older Pygments versions, like "Python 3"
+            classname = self.index.get(''.join(name.split()))
+        return classname
+
+    def haslexer(self, name):
+        '''Check if name is a known alias or long name.'''
+
+        return self.findclassname(name) is not None
+
+    def lexerclass(self, name):
+        '''Return the lexer class matching an alias or a long name, or None.'''
+
+        classname = self.findclassname(name)
+        if classname is None:
+            return None
+        if classname in self.plugins:
+            return self.plugins[classname]
+        return getattr(import_module(LEXERS[classname][0]), classname)
+
+
+def build_catalog():
+    '''Build the catalog from the Pygments mapping files.'''
+
+    longnames = [longname for _, longname, _, _, _ in LEXERS.values()]
+    longnames.extend(longname for longname, _ in EXTRA_LEXERS)
+    lexernames = sorted(longnames, key=str.casefold)
+    styles = [style[1] for style in STYLES.values()] + list(EXTRA_STYLES)
+    styles.sort(key=stylekey)
+
+    # aliases first, in Pygments lookup order, then long names and shortcuts
+    index = {}
+    for classname, (_, longname, lexaliases, _, _) in LEXERS.items():
+        for alias in lexaliases:
+            index.setdefault(alias.casefold(), classname)
+    for classname, (_, longname, _, _, _) in LEXERS.items():
+        index.setdefault(longname.casefold(), classname)
+    for name, classname in SHORTCUTS.items():
+        index.setdefault(name, classname)
+    return Catalog(lexernames, styles, index)
+
+
+def load_catalog(cachedir, extver):
+    '''
+    Return the catalog, read from the disk cache in <cachedir> when it matches
+    current Pygments and extension versions, rebuilt and saved otherwise.
+    '''
+
+    key = [CATALOG_FORMAT, pygments.__version__, extver]
+    cachefile = os.path.join(cachedir, CATALOG_FILENAME) if cachedir else None
+    catalog = None
+    if cachefile:
+        try:
+            with open(cachefile, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('key') == key:
+                catalog = Catalog(data['lexernames'], data['styles'], data['index'])
+                logger.debug(f"Lexer catalog loaded from {cachefile}.")
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if catalog is None:
+        catalog = build_catalog()
+        if cachefile:
+            try:
+                data = catalog.todict()
+                data['key'] = key
+                with open(cachefile, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                logger.debug(f"Lexer catalog saved to {cachefile}.")
+            except OSError:
+                logger.exception("Lexer catalog could not be saved.")
+    try:
+        catalog.addplugins(find_plugin_lexers())
+    except Exception:
+        logger.exception("Plugin lexers could not be loaded.")
+    try:
+        catalog.addpluginstyles(find_plugin_styles())
+    except Exception:
+        logger.exception("Plugin styles could not be loaded.")
+    return catalog
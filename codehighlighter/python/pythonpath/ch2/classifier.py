@@ -0,0 +1,287 @@
+"""
+    ch2.classifier
+    ~~~~~~~~~~~~~~
+
+    Compact statistical language classifier, used as a fast path for
+    automatic language detection.
+
+    Character n-grams are hashed into a fixed number of buckets. For each
+    bucket, the model keeps the few lexers for which the bucket is the most
+    characteristic, with a quantized log-likelihood ratio. Scoring a text is
+    then a handful of array lookups per distinct n-gram, in pure Python.
+
+    The model is optional: it is loaded from ch2/classifier.bin when that
+    file is shipped in the extension, otherwise automatic detection relies
+    on the analyse_text() methods only.
+
+    Train and benchmark from the pythonpath folder, with corpora laid out as
+    <corpus>/<lexer alias>/<sample files>, like Pygments tests/examplefiles
+    and tests/snippets (token dumps are skipped, only test inputs are read):
+
+        python -m ch2.classifier train <corpus> [<corpus> ...]
+        python -m ch2.classifier bench <corpus> [<corpus> ...]
+
+    One sample file out of HOLDOUT of each lexer is held out of training,
+    and the benchmark only runs on those, cut into snippets of SNIPPET_LINES.
+
+    :license: GPL, see LICENSE for details.
+"""
+
+import math
+import os.path
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+
+MODEL_FILE = os.path.join(os.path.dirname(__file__), 'classifier.bin')
+MAGIC = b'CH2C'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIBBf')   # magic, version, classes, buckets, ngram size, slots, scale
+
+NBUCKETS = 1 << 15
+NGRAM = 3
+SLOTS = 6           # lexers kept per bucket
+MAXCHARS = 4096     # only the beginning of long snippets is considered
+HOLDOUT = 4         # the second sample file of every HOLDOUT of a lexer is kept for the benchmark
+SNIPPET_LINES = 20  # benchmark snippet size
+
+_model = None
+
+
+def ngram_buckets(text, nbuckets=NBUCKETS, n=NGRAM):
+    '''Return a Counter of hashed character n-gram buckets of text.'''
+
+    text = ' '.join(text[:MAXCHARS].split())    # normalize whitespace
+    crc32 = zlib.crc32
+    grams = Counter(text[i:i+n] for i in range(len(text) - n + 1))
+    buckets = Counter()
+    for gram, count in grams.items():
+        buckets[crc32(gram.encode('utf-8')) % nbuckets] += count
+    return buckets
+
+
+class Classifier:
+    '''
+    Sparse hashed n-gram classifier.
+
+    classnames: Pygments lexer class names (keys of pygments.lexers._mapping.LEXERS)
+    priors: array of per-class log priors
+    slotclasses: array of class indexes, SLOTS per bucket (0xffff = empty slot)
+    slotweights: array of quantized weights, SLOTS per bucket
+    '''
+
+    def __init__(self, classnames, priors, slotclasses, slotweights, nbuckets=NBUCKETS,
+                 ngram=NGRAM, slots=SLOTS, scale=1.0):
+        self.classnames = classnames
+        self.priors = priors
+        self.slotclasses = slotclasses
+        self.slotweights = slotweights
+        self.nbuckets = nbuckets
+        self.ngram = ngram
+        self.slots = slots
+        self.scale = scale
+
+    def scores(self, text):
+        '''Return the list of raw per-class scores of text.'''
+
+        scores = list(self.priors)
+        slots = self.slots
+        slotclasses, slotweights = self.slotclasses, self.slotweights
+        for bucket, count in ngram_buckets(text, self.nbuckets, self.ngram).items():
+            base = bucket * slots
+            for i in range(base, base + slots):
+                classid = slotclasses[i]
+                if classid == 0xffff:
+                    break
+                scores[classid] += count * slotweights[i]
+        return scores
+
+    def shortlist(self, text, k=5):
+        '''Return the k most probable (class name, probability) pairs for text.'''
+
+        scores = self.scores(text)
+        top = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:k]
+        if not top:
+            return []
+        best = scores[top[0]]
+        # softmax over the whole model, weights are stored divided by <scale>
+        total = sum(math.exp((s - best) * self.scale) for s in scores)
+        return [(self.classnames[i], math.exp((scores[i] - best) * self.scale) / total) for i in top]
+
+    # serialization
+    def dumps(self):
+        names = '\0'.join(self.classnames).encode('utf-8')
+        return b''.join((HEADER.pack(MAGIC, FORMAT_VERSION, len(self.classnames), self.nbuckets,
+                                     self.ngram, self.slots, self.scale),
+                         struct.pack('<I', len(names)), names,
+                         self.priors.tobytes(), self.slotclasses.tobytes(), self.slotweights.tobytes()))
+
+    @classmethod
+    def loads(cls, data):
+        magic, version, nclasses, nbuckets, ngram, slots, scale = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Unsupported classifier model.")
+        pos = HEADER.size
+        (namelen,) = struct.unpack_from('<I', data, pos)
+        pos += 4
+        classnames = data[pos:pos+namelen].decode('utf-8').split('\0')
+        pos += namelen
+        arrays = []
+        for typecode, count in (('f', nclasses), ('H', nbuckets * slots), ('b', nbuckets * slots)):
+            a = array(typecode)
+            size = a.itemsize * count
+            a.frombytes(data[pos:pos+size])
+            pos += size
+            if sys.byteorder == 'big':
+                a.byteswap()
+            arrays.append(a)
+        return cls(classnames, *arrays, nbuckets=nbuckets, ngram=ngram, slots=slots, scale=scale)
+
+
+def load_model(path=MODEL_FILE):
+    '''Return the shipped classifier, or None if the extension does not provide one.'''
+
+    global _model
+    if _model is None:
+        try:
+            with open(path, 'rb') as f:
+                _model = Classifier.loads(f.read())
+        except (OSError, ValueError, struct.error):
+            _model = False
+    return _model or None
+
+
+# training and benchmark
+def read_sample(path):
+    '''Return the text of a sample file, the input section of Pygments token tests.'''
+
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if text.startswith('---input---\n'):
+        text = text[len('---input---\n'):].partition('\n---tokens---\n')[0]
+    return text
+
+
+def read_corpus(corpora, heldout=False):
+    '''
+    Yield (lexer class name, text) pairs from <corpus>/<lexer alias>/<files> of each corpus.
+
+    heldout: yield the held out samples instead of the training ones
+    '''
+
+    from pygments.lexers._mapping import LEXERS
+    aliases = {}
+    for classname, (_, _, lexaliases, _, _) in LEXERS.items():
+        for alias in lexaliases:
+            aliases.setdefault(alias, classname)
+    for corpus in corpora:
+        for alias in sorted(os.listdir(corpus)):
+            classname = aliases.get(alias.lower())
+            folder = os.path.join(corpus, alias)
+            if classname is None or not os.path.isdir(folder):
+                continue
+            filenames = sorted(f for f in os.listdir(folder) if not f.endswith('.output'))
+            for i, filename in enumerate(filenames):
+                if (i % HOLDOUT == 1) != heldout:
+                    continue
+                try:
+                    text = read_sample(os.path.join(folder, filename))
+                except (OSError, UnicodeDecodeError):
+                    continue
+                if text.strip():
+                    yield classname, text
+
+
+def snippets(samples, lines=SNIPPET_LINES):
+    '''Cut (lexer class name, text) samples into snippets of at most <lines> lines, skipping blank ones.'''
+
+    for classname, text in samples:
+        textlines = text.splitlines()
+        for i in range(0, len(textlines), lines):
+            snippet = '\n'.join(textlines[i:i+lines])
+            if snippet.strip():
+                yield classname, snippet
+
+
+def train(samples, nbuckets=NBUCKETS, ngram=NGRAM, slots=SLOTS):
+    '''Build a Classifier from (lexer class name, text) pairs.'''
+
+    counts = {}
+    ndocs = Counter()
+    for classname, text in samples:
+        ndocs[classname] += 1
+        counts.setdefault(classname, Counter()).update(ngram_buckets(text, nbuckets, ngram))
+    classnames = sorted(counts)
+    background = Counter()
+    for c in counts.values():
+        background.update(c)
+    bgtotal = sum(background.values()) + nbuckets
+
+    # log-likelihood ratio of each bucket for each class, against all classes
+    candidates = [[] for _ in range(nbuckets)]
+    for classid, classname in enumerate(classnames):
+        c = counts[classname]
+        total = sum(c.values()) + nbuckets
+        for bucket, count in c.items():
+            llr = math.log((count + 1) / total) - math.log((background[bucket] + 1) / bgtotal)
+            if llr > 0:
+                candidates[bucket].append((llr, classid))
+    maxllr = max((max(b)[0] for b in candidates if b), default=1.0)
+    scale = maxllr / 127
+
+    slotclasses = array('H', [0xffff]) * (nbuckets * slots)
+    slotweights = array('b', [0]) * (nbuckets * slots)
+    for bucket, cands in enumerate(candidates):
+        cands.sort(reverse=True)
+        for i, (llr, classid) in enumerate(cands[:slots]):
+            slotclasses[bucket * slots + i] = classid
+            slotweights[bucket * slots + i] = max(1, round(llr / scale))
+    alldocs = sum(ndocs.values())
+    priors = array('f', (math.log(ndocs[name] / alldocs) / scale for name in classnames))
+    return Classifier(classnames, priors, slotclasses, slotweights, nbuckets, ngram, slots, scale)
+
+
+def benchmark(corpora, model):
+    '''Compare accuracy and latency of guess_lexer() and of the classifier fast path on held out snippets.'''
+
+    from pygments.lexers import guess_lexer
+    from pygments.util import ClassNotFound
+    from ch2.detect import guess_lexer_class
+
+    results = {'guess_lexer': [0, 0.0], 'classifier': [0, 0.0]}
+    samples = list(snippets(read_corpus(corpora, heldout=True)))
+    for classname, text in samples:
+        t = time.perf_counter()
+        try:
+            found = type(guess_lexer(text)).__name__
+        except ClassNotFound:
+            found = None
+        results['guess_lexer'][1] += time.perf_counter() - t
+        results['guess_lexer'][0] += found == classname
+
+        t = time.perf_counter()
+        try:
+            found = guess_lexer_class(text, model=model).__name__
+        except ClassNotFound:
+            found = None
+        results['classifier'][1] += time.perf_counter() - t
+        results['classifier'][0] += found == classname
+    for name, (correct, duration) in results.items():
+        print(f"{name:12} accuracy {correct / max(len(samples), 1):6.1%}   "
+              f"mean latency {duration * 1000 / max(len(samples), 1):7.2f} ms   ({len(samples)} samples)")
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('train', 'bench'):
+        sys.exit(__doc__)
+    if sys.argv[1] == 'train':
+        model = train(read_corpus(sys.argv[2:]))
+        with open(MODEL_FILE, 'wb') as f:
+            f.write(model.dumps())
+        print(f"{len(model.classnames)} lexers, model written to {MODEL_FILE}.")
+    else:
+        benchmark(sys.argv[2:], load_model())
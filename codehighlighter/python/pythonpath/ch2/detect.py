@@ -0,0 +1,264 @@
+"""
+    ch2.detect
+    ~~~~~~~~~~
+
+    Automatic language detection without importing every lexer module.
+
+    Only lexers that define their own analyse_text() can ever be chosen by
+    pygments.lexers.guess_lexer(), so the detection index (ch2._analysers,
+    generated offline by running this module) lists them in Pygments
+    iteration order. Analysers that merely check the shebang line, the
+    doctype or the first characters of the text are evaluated from their
+    recorded signal, without importing their module.
+    The statistical classifier shipped in ch2/classifier.bin gives a
+    shortlist that is confirmed by analyse_text() before the exhaustive
+    pass, which runs when no candidate is confirmed; without it, results
+    are the same as guess_lexer().
+    DetectionMemo remembers the results per document, so identical snippets
+    are only detected once.
+
+    Run ``python -m ch2.detect`` from the pythonpath folder to regenerate the
+    index after a Pygments update.
+
+    :license: GPL, see LICENSE for details.
+"""
+
+import ast
+import hashlib
+import inspect
+import os.path
+import textwrap
+from collections import Counter, OrderedDict
+from importlib import import_module
+
+import pygments
+from pygments.lexers import find_lexer_class_by_name, find_plugin_lexers, guess_lexer
+from pygments.lexers._mapping import LEXERS
+from pygments.modeline import get_filetype_from_buffer
+from pygments.util import ClassNotFound, doctype_matches, shebang_matches
+
+from ch2.classifier import load_model
+
+# cheap signals: analysers returning one of these checks score 1.0 or nothing
+SIGNALS = {
+    'shebang_matches': shebang_matches,
+    'doctype_matches': doctype_matches,
+    'startswith': str.startswith,
+}
+SHORTLIST = 5       # number of classifier candidates checked by analyse_text()
+PRIORS = 3          # languages already chosen in a document tried before full detection
+PRIOR_SCORE = 0.8   # analyse_text() score accepted for a prior language
+PRIOR_PROBABILITY = 0.5     # classifier probability accepted for a prior language its analyser does not reject
+_DEFAULT = object()
+
+
+def _lexerclass(modulename, classname):
+    return getattr(import_module(modulename), classname)
+
+
+def _classify(text, model, analysers, hasshebang):
+    '''
+    Return the lexer class chosen by cheap signals and the classifier shortlist, or None.
+
+    Signals and shortlisted analysers are evaluated in index order, so the first one
+    returning 1.0 wins as in guess_lexer(). Otherwise the best scoring candidate whose
+    analyse_text() is above 0 is chosen, the classifier only breaking ties; it never
+    decides alone.
+    '''
+
+    shortlist = {classname: p for classname, p in model.shortlist(text, SHORTLIST) if classname in LEXERS}
+    if not shortlist:
+        return None
+    confirmed = []
+    for modulename, classname, signal in analysers:
+        if signal is not None:
+            check, arg = signal
+            if check == 'shebang_matches' and not hasshebang:
+                continue
+            if SIGNALS[check](text, arg):
+                return _lexerclass(modulename, classname)
+        elif classname in shortlist:
+            lexerclass = _lexerclass(modulename, classname)
+            rv = lexerclass.analyse_text(text)
+            if rv == 1.0:
+                return lexerclass
+            if rv > 0.0:
+                confirmed.append((rv, shortlist[classname], lexerclass))
+    if not confirmed:
+        return None
+    return max(confirmed, key=lambda candidate: candidate[:2])[2]
+
+
+def guess_lexer_class(text, model=_DEFAULT):
+    '''
+    Return the lexer class guessed from text, as guess_lexer() would.
+    Raise pygments.util.ClassNotFound if no lexer thinks it can handle the text.
+
+    model: statistical classifier used as a fast path, defaults to the shipped one if any
+    '''
+
+    try:
+        from ch2._analysers import PYGMENTS_VERSION, ANALYSERS
+    except ImportError:
+        PYGMENTS_VERSION = None
+    if PYGMENTS_VERSION != pygments.__version__:
+        # outdated index, do it the slow way
+        return type(guess_lexer(text))
+
+    # try to get a vim modeline first
+    ft = get_filetype_from_buffer(text)
+    if ft is not None:
+        try:
+            return find_lexer_class_by_name(ft)
+        except ClassNotFound:
+            pass
+
+    hasshebang = text[:2] == '#!'
+    if model is _DEFAULT:
+        model = load_model()
+    if model is not None:
+        lexerclass = _classify(text, model, ANALYSERS, hasshebang)
+        if lexerclass is not None:
+            return lexerclass
+
+    best = (0.0, None)
+    for modulename, classname, signal in ANALYSERS:
+        if signal is not None:
+            check, arg = signal
+            if check == 'shebang_matches' and not hasshebang:
+                continue
+            if SIGNALS[check](text, arg):
+                return _lexerclass(modulename, classname)
+            continue
+        lexerclass = _lexerclass(modulename, classname)
+        rv = lexerclass.analyse_text(text)
+        if rv == 1.0:
+            return lexerclass
+        if rv > best[0]:
+            best = (rv, lexerclass)
+    for lexerclass in find_plugin_lexers():
+        rv = lexerclass.analyse_text(text)
+        if rv == 1.0:
+            return lexerclass
+        if rv > best[0]:
+            best = (rv, lexerclass)
+    if not best[0] or best[1] is None:
+        raise ClassNotFound('no lexer matching the text found')
+    return best[1]
+
+
+def memokey(text):
+    '''Return the detection memo key of text: hash and prefix of its whitespace-normalized content.'''
+
+    normalized = ' '.join(text.split())
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest(), normalized[:32]
+
+
+class DetectionMemo:
+    '''
+    Detected lexer classes of a document, keyed by snippet content.
+
+    Languages already chosen in the document are tried first on new
+    snippets, and accepted without full detection when they fit well.
+    '''
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._classes = OrderedDict()
+        self.prior = Counter()
+
+    def __len__(self):
+        return len(self._classes)
+
+    def guess(self, text):
+        '''Return the lexer class of text, as guess_lexer_class() would, memoized.'''
+
+        key = memokey(text)
+        try:
+            lexerclass = self._classes[key]
+        except KeyError:
+            try:
+                lexerclass = self._fromprior(text) or guess_lexer_class(text)
+            except ClassNotFound:
+                lexerclass = None
+            self._classes[key] = lexerclass
+            while len(self._classes) > self.maxsize:
+                self._classes.popitem(last=False)
+            if lexerclass is not None:
+                self.prior[lexerclass] += 1
+        else:
+            self._classes.move_to_end(key)
+        if lexerclass is None:
+            raise ClassNotFound('no lexer matching the text found')
+        return lexerclass
+
+    def _fromprior(self, text):
+        candidates = self.prior.most_common(PRIORS)
+        if not candidates:
+            return None
+        model = load_model()
+        probabilities = dict(model.shortlist(text, SHORTLIST)) if model is not None else {}
+        for lexerclass, _ in candidates:
+            rv = lexerclass.analyse_text(text)
+            if rv >= PRIOR_SCORE or (rv > 0.0 and probabilities.get(lexerclass.__name__, 0.0) >= PRIOR_PROBABILITY):
+                return lexerclass
+        return None
+
+
+# index generation
+def _signal(lexerclass):
+    '''Return the (check, argument) signal of an analyser made of a single cheap check, or None.'''
+
+    analyser = lexerclass.__dict__.get('analyse_text')
+    try:
+        # analyse_text() is wrapped by pygments.util.make_analysator()
+        func = analyser.__func__.__closure__[0].cell_contents
+        tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    except (AttributeError, IndexError, TypeError, OSError, SyntaxError):
+        return None
+    body = tree.body[0].body
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+        body = body[1:]     # docstring
+    if len(body) != 1 or not isinstance(body[0], ast.Return):
+        return None
+    call = body[0].value
+    if not isinstance(call, ast.Call) or call.keywords:
+        return None
+    # return shebang_matches(text, r'...') / doctype_matches(text, r'...')
+    if (isinstance(call.func, ast.Name) and call.func.id in SIGNALS and len(call.args) == 2
+            and isinstance(call.args[0], ast.Name) and call.args[0].id == 'text'
+            and isinstance(call.args[1], ast.Constant) and isinstance(call.args[1].value, str)):
+        return call.func.id, call.args[1].value
+    # return text.startswith('...')
+    if (isinstance(call.func, ast.Attribute) and call.func.attr == 'startswith'
+            and isinstance(call.func.value, ast.Name) and call.func.value.id == 'text'
+            and len(call.args) == 1 and isinstance(call.args[0], ast.Constant)
+            and isinstance(call.args[0].value, str)):
+        return 'startswith', call.args[0].value
+    return None
+
+
+def generate_index():
+    '''Return the source of ch2/_analysers.py for the current Pygments version.'''
+
+    from pygments.lexer import Lexer
+    from pygments.lexers import _iter_lexerclasses
+
+    lines = []
+    for lexerclass in _iter_lexerclasses(plugins=False):
+        if lexerclass.analyse_text is Lexer.analyse_text:
+            continue
+        entry = (lexerclass.__module__, lexerclass.__name__, _signal(lexerclass))
+        lines.append(f'    {entry!r},')
+    return ("# Automatically generated by ch2/detect.py.\n"
+            "# DO NOT EDIT BY HAND; run `python -m ch2.detect` from the pythonpath folder instead.\n\n"
+            f"PYGMENTS_VERSION = {pygments.__version__!r}\n\n"
+            "# (module name, class name, (check, argument) signal or None), in Pygments iteration order\n"
+            "ANALYSERS = (\n" + "\n".join(lines) + "\n)\n")
+
+
+if __name__ == '__main__':
+    indexfile = os.path.join(os.path.dirname(__file__), '_analysers.py')
+    with open(indexfile, 'w', encoding='utf-8') as f:
+        f.write(generate_index())
+    print(f"Detection index written to {indexfile}.")
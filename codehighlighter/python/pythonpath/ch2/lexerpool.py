@@ -0,0 +1,52 @@
+"""
+    ch2.lexerpool
+    ~~~~~~~~~~~~~
+
+    Pool of configured lexer instances, shared by every code block and trigger.
+
+    Pygments lexers do not keep any state between two get_tokens() calls,
+    so the same configured instance can be reused as long as its options
+    do not change.
+
+    :license: GPL, see LICENSE for details.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LexerPool:
+    '''Bounded, thread-safe LRU pool of lexer instances keyed by (lexer class, options).'''
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._lexers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lexers)
+
+    def get(self, lexerclass, **options):
+        '''Return a pooled instance of lexerclass configured with options, creating it if needed.'''
+
+        key = (lexerclass, tuple(sorted(options.items())))
+        with self._lock:
+            lexer = self._lexers.get(key)
+            if lexer is not None:
+                self._lexers.move_to_end(key)
+                return lexer
+        # instantiate outside of the lock, some lexers are slow to build
+        lexer = lexerclass(**options)
+        with self._lock:
+            lexer = self._lexers.setdefault(key, lexer)
+            self._lexers.move_to_end(key)
+            while len(self._lexers) > self.maxsize:
+                self._lexers.popitem(last=False)
+        return lexer
+
+    def clear(self):
+        with self._lock:
+            self._lexers.clear()
+
+
+pool = LexerPool()
@@ -0,0 +1,167 @@
+"""
+    ch2.plan
+    ~~~~~~~~
+
+    Highlight planning stage for Code Highlighter 2.
+
+    Turns a Pygments token stream into a compact list of spans, each span
+    pointing to a shared property tuple. Spans are expressed in the unit of
+    the text cursors that will apply them: code points for Writer text,
+    UTF-16 code units for EditEngine text (shapes, Calc cells), where
+    characters outside the BMP (emoji, math symbols...) count as two units
+    (see issue #22). Their positions are collected once while scanning
+    tokens, so that offsets are converted by bisection instead of
+    per-character sums.
+    No UNO dependency, so that plans can be built, cached and benchmarked
+    away from the bridge.
+
+    :license: GPL, see LICENSE for details.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+
+ASTRAL = re.compile('[\U00010000-\U0010ffff]')
+
+
+def utf16_len(s):
+    '''Length of a string in UTF-16 code units.'''
+
+    if s.isascii():
+        return len(s)
+    return len(s.encode('utf-16-le')) // 2
+
+
+def utf16_offset(astrals, index):
+    '''
+    Convert a code point offset into a UTF-16 code unit offset.
+
+    astrals: ascending code point offsets of the characters outside the BMP
+    '''
+
+    return index + bisect_left(astrals, index) if astrals else index
+
+
+class HighlightPlan:
+    '''
+    Formatting plan of one code block.
+
+    spans: list of (start, length, propid) tuples, ordered by start
+    props: list of hashable property tuples, indexed by propid
+    '''
+
+    __slots__ = ('spans', 'props')
+
+    def __init__(self):
+        self.spans = []
+        self.props = []
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __iter__(self):
+        props = self.props
+        for start, length, propid in self.spans:
+            yield start, length, props[propid]
+
+    def dominant(self):
+        '''Return the propid covering the largest part of the code, or None if plan is empty.'''
+
+        coverage = [0] * len(self.props)
+        for _, length, propid in self.spans:
+            coverage[propid] += length
+        if not coverage:
+            return None
+        return coverage.index(max(coverage))
+
+    def styled_spans(self, skip=None):
+        '''Yield the spans whose propid differs from <skip>.'''
+
+        for span in self.spans:
+            if span[2] != skip:
+                yield span
+
+
+def locate(starts, offset):
+    '''
+    Split an absolute offset into (paragraph index, offset in paragraph).
+
+    starts: ascending list of paragraph start offsets, the first one being 0
+    '''
+
+    index = bisect_right(starts, offset) - 1
+    return index, offset - starts[index]
+
+
+def build_plan(tokens, resolve, wskey=None, utf16=False):
+    '''
+    Build the highlight plan of a token stream.
+    Consecutive tokens are coalesced as long as they resolve to the same
+    property tuple, whatever their token type.
+
+    tokens: iterable of (tokentype, value) pairs, as returned by lexer.get_tokens()
+    resolve: callable returning the property tuple of a token type
+    wskey: callable returning the part of a property tuple that is visible on
+           whitespace (background, underline...), or None if whitespace-only runs
+           must keep their own properties
+    utf16: count spans in UTF-16 code units instead of code points
+    '''
+
+    plan = HighlightPlan()
+    props = plan.props
+    propids = {}
+    typeids = {}
+    astrals = []
+    finditer = ASTRAL.finditer
+
+    # first pass: coalesce consecutive tokens with same properties (in code points)
+    runs = []   # [start, length, propid, whitespace only]
+    start = 0
+    for tok_type, tok_value in tokens:
+        propid = typeids.get(tok_type)
+        if propid is None:
+            tok_props = resolve(tok_type)
+            propid = propids.get(tok_props)
+            if propid is None:
+                propid = propids[tok_props] = len(props)
+                props.append(tok_props)
+            typeids[tok_type] = propid
+        length = len(tok_value)
+        if not length:
+            continue
+        if utf16 and not tok_value.isascii():
+            astrals.extend(start + m.start() for m in finditer(tok_value))
+        wsonly = tok_value.isspace()
+        if runs and runs[-1][2] == propid:
+            run = runs[-1]
+            run[1] += length
+            run[3] = run[3] and wsonly
+        else:
+            runs.append([start, length, propid, wsonly])
+        start += length
+    # trailing whitespace does not need any formatting
+    if runs and runs[-1][3]:
+        runs.pop()
+    if astrals:
+        for run in runs:
+            end = utf16_offset(astrals, run[0] + run[1])
+            run[0] = utf16_offset(astrals, run[0])
+            run[1] = end - run[0]
+
+    # second pass: whitespace-only runs join the longest compatible neighbour
+    spans = plan.spans
+    for i, (start, length, propid, wsonly) in enumerate(runs):
+        if wsonly and wskey:
+            key = wskey(props[propid])
+            best = None
+            for neighbour in (spans[-1] if spans else None, runs[i+1] if i+1 < len(runs) else None):
+                if neighbour and neighbour[2] != propid and wskey(props[neighbour[2]]) == key:
+                    if best is None or neighbour[1] > best[1]:
+                        best = neighbour
+            if best is not None:
+                propid = best[2]
+        if spans and spans[-1][2] == propid:
+            spans[-1] = (spans[-1][0], spans[-1][1] + length, propid)
+        else:
+            spans.append((start, length, propid))
+    return plan
@@ -0,0 +1,88 @@
+"""
+    ch2.styletable
+    ~~~~~~~~~~~~~~
+
+    Precompiled property tables of Pygments styles.
+
+    A table maps every token type of a style to a hashable property tuple,
+    so that resolving a token costs a single dict lookup. Tables are built
+    once per (style, character background, character styles) combination
+    and kept for the lifetime of the Python process.
+
+    :license: GPL, see LICENSE for details.
+"""
+
+_tables = {}
+
+
+def to_int(hex_str):
+    '''Convert hexadecimal color representation into decimal integer.'''
+
+    if hex_str:
+        return int(hex_str[-6:], 16)
+    return 0
+
+
+class StyleTable:
+    '''
+    Token type -> property tuple mapping of a Pygments style.
+
+    Property tuples are either
+        (color, bold, italic, underline, bgcolor) for direct formatting, or
+        (charstylename,) when character styles are used.
+    '''
+
+    def __init__(self, style, char_bg_color=None, styleprefix=None):
+        self.style = style
+        self.char_bg_color = char_bg_color
+        self.styleprefix = styleprefix
+        self.types = {}
+        # property tuple -> first token type compiled to it
+        self.ttypes = {}
+        # part of each property tuple that is visible on whitespace
+        self.wskeys = {}
+        for ttype in style._styles:
+            self._compile(ttype)
+
+    def _compile(self, ttype):
+        tok_style = self.style.style_for_token(ttype)
+        bgcolor = tok_style["bgcolor"]
+        if self.styleprefix:
+            props = (str(ttype).replace('Token', self.styleprefix),)
+        else:
+            bgcolor = bgcolor or self.char_bg_color
+            props = (to_int(tok_style['color']), tok_style['bold'], tok_style['italic'],
+                     tok_style['underline'], to_int(bgcolor) if bgcolor else None)
+        self.wskeys[props] = (tok_style['underline'], to_int(bgcolor) if bgcolor else None)
+        self.types[ttype] = props
+        self.ttypes.setdefault(props, ttype)
+        return props
+
+    def resolve(self, ttype):
+        '''Return the property tuple of a token type, falling back on its closest styled parent.'''
+
+        try:
+            return self.types[ttype]
+        except KeyError:
+            parent = ttype.parent
+            while parent not in self.style._styles:
+                parent = parent.parent
+            props = self.types[ttype] = self.types[parent]
+            return props
+
+
+def get_table(style, char_bg_color=None, styleprefix=None):
+    '''
+    Return the compiled table of a style, building it on first use.
+
+    char_bg_color: background applied to tokens without own background (direct formatting only)
+    styleprefix: character style prefix, if character styles are used
+    '''
+
+    if styleprefix:
+        char_bg_color = None
+    key = (style, char_bg_color, styleprefix)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = StyleTable(style, char_bg_color, styleprefix)
+    return table
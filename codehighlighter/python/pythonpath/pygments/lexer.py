@@ -417,6 +417,27 @@ class _This:
 this = _This()
 
 
+def _delegate_lexer(lexer, cls, kwargs):
+    """
+    Return an instance of `cls` created with `kwargs` updated with the
+    options of `lexer`. Instances are cached on `lexer`, so that they are
+    created only once per parent lexer instead of once per match.
+    """
+    options = dict(kwargs)
+    options.update(lexer.options)
+    try:
+        key = (cls, tuple(sorted(options.items())))
+        hash(key)
+    except TypeError:
+        # unhashable option values, do not cache
+        return cls(**options)
+    cache = lexer.__dict__.setdefault('_delegate_lexers', {})
+    lx = cache.get(key)
+    if lx is None:
+        lx = cache[key] = cls(**options)
+    return lx
+
+
 def using(_other, **kwargs):
     """
     Callback that processes the match with a different lexer.
@@ -441,11 +462,9 @@ def using(_other, **kwargs):
     if _other is this:
         def callback(lexer, match, ctx=None):
             # if keyword arguments are given the callback
-            # function has to create a new lexer instance
+            # function has to use another lexer instance
             if kwargs:
-                # XXX: cache that somehow
-                kwargs.update(lexer.options)
-                lx = lexer.__class__(**kwargs)
+                lx = _delegate_lexer(lexer, lexer.__class__, kwargs)
             else:
                 lx = lexer
             s = match.start()
@@ -455,9 +474,7 @@ def using(_other, **kwargs):
                 ctx.pos = match.end()
     else:
         def callback(lexer, match, ctx=None):
-            # XXX: cache that somehow
-            kwargs.update(lexer.options)
-            lx = _other(**kwargs)
+            lx = _delegate_lexer(lexer, _other, kwargs)
 
             s = match.start()
             for i, t, v in lx.get_tokens_unprocessed(match.group(), **gt_kwargs):
@@ -0,0 +1,8 @@
+import os.path
+import sys
+
+# embedded Pygments and ch2 helpers, as the extension loads them
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "codehighlighter", "python", "pythonpath"))
+# pytest may have imported an installed Pygments already
+for name in [name for name in sys.modules if name == "pygments" or name.startswith("pygments.")]:
+    del sys.modules[name]
@@ -0,0 +1,36 @@
+from pygments.style import Style
+
+from ch2.catalog import build_catalog, load_catalog
+
+
+class PluginStyle(Style):
+    pass
+
+
+def test_styles():
+    catalog = build_catalog()
+    assert catalog.styles[0] == 'default'
+    assert 'monokai' in catalog.styles
+    assert 'libreoffice-dark' in catalog.styles
+
+
+def test_plugin_styles():
+    catalog = build_catalog()
+    catalog.addpluginstyles([('zz-plugin', PluginStyle), ('monokai', PluginStyle)])
+    assert catalog.styles[0] == 'default'
+    assert catalog.styles.count('monokai') == 1
+    assert 'zz-plugin' in catalog.styles
+
+
+def test_plugins_not_cached(tmp_path):
+    catalog = load_catalog(str(tmp_path), "1.0")
+    catalog.addpluginstyles([('zz-plugin', PluginStyle)])
+    assert 'zz-plugin' not in load_catalog(str(tmp_path), "1.0").styles
+
+
+def test_lexers():
+    catalog = build_catalog()
+    assert catalog.haslexer("python")
+    assert catalog.haslexer("LibreOffice Basic")
+    assert catalog.lexerclass("py").__name__ == 'PythonLexer'
+    assert catalog.lexerclass("no such language") is None
@@ -0,0 +1,82 @@
+import pytest
+from pygments.lexers import guess_lexer
+from pygments.util import ClassNotFound
+
+from ch2.classifier import load_model
+from ch2.detect import DetectionMemo, guess_lexer_class, memokey
+
+SAMPLES = [
+    "#!/usr/bin/env python\nprint('hello')\n",
+    "#!/bin/bash\necho hello\n",
+    "<?xml version=\"1.0\"?>\n<root><child/></root>\n",
+    "<!DOCTYPE html>\n<html><body><p>Hello</p></body></html>\n",
+    "#include <stdio.h>\n\nint main(void)\n{\n    printf(\"hello\");\n    return 0;\n}\n",
+    "def f(x):\n    return x + 1\n",
+    "SELECT name FROM users WHERE id = 1;\n",
+    "diff --git a/f b/f\n--- a/f\n+++ b/f\n@@ -1 +1 @@\n-a\n+b\n",
+    "\\documentclass{article}\n\\begin{document}\nHello\n\\end{document}\n",
+    "# vim: set ft=ruby :\nputs 'hello'\n",
+    "{\"key\": [1, 2, 3]}\n",
+    "#!/usr/bin/env python\nprint('hello')",
+    "fn main() {\n    println!(\"hello\");\n}\n",
+]
+
+
+def guessed(text):
+    try:
+        return type(guess_lexer(text))
+    except ClassNotFound:
+        return None
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_same_as_guess_lexer(text):
+    # without the statistical classifier, results are those of guess_lexer()
+    try:
+        lexerclass = guess_lexer_class(text, model=None)
+    except ClassNotFound:
+        lexerclass = None
+    assert lexerclass is guessed(text)
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_classifier_confirmed(text):
+    # the shipped classifier only shortlists candidates, analyse_text() decides
+    assert load_model() is not None
+    try:
+        lexerclass = guess_lexer_class(text)
+    except ClassNotFound:
+        lexerclass = None
+    assert lexerclass is guessed(text)
+
+
+def test_prior_confirmed():
+    memo = DetectionMemo()
+    assert memo.guess(SAMPLES[0]) is guessed(SAMPLES[0])
+    # a language already chosen in the document is not accepted when its analyser rejects the text
+    for text in SAMPLES[1:]:
+        assert memo.guess(text) is guessed(text)
+
+
+def test_index_is_current():
+    import pygments
+    from ch2._analysers import PYGMENTS_VERSION
+    assert PYGMENTS_VERSION == pygments.__version__
+
+
+def test_memokey():
+    assert memokey("a  b\n\tc") == memokey(" a b c ")
+    assert memokey("a b") != memokey("a c")
+
+
+def test_memo():
+    memo = DetectionMemo(maxsize=2)
+    text = SAMPLES[0]
+    lexerclass = memo.guess(text)
+    assert lexerclass is guess_lexer_class(text)
+    assert memo.guess(text + "\n\n") is lexerclass
+    assert len(memo) == 1
+    assert memo.prior[lexerclass] == 1
+    memo.guess(SAMPLES[1])
+    memo.guess(SAMPLES[2])
+    assert len(memo) == 2
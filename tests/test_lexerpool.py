@@ -0,0 +1,31 @@
+from pygments.lexers import CLexer, PythonLexer
+
+from ch2.lexerpool import LexerPool
+
+
+def test_shared_instances():
+    pool = LexerPool()
+    lexer = pool.get(PythonLexer, stripnl=False)
+    assert pool.get(PythonLexer, stripnl=False) is lexer
+    assert not lexer.stripnl
+    assert pool.get(PythonLexer) is not lexer
+    assert pool.get(CLexer, stripnl=False) is not lexer
+    assert len(pool) == 3
+
+
+def test_option_order():
+    pool = LexerPool()
+    assert pool.get(PythonLexer, stripnl=False, tabsize=4) is pool.get(PythonLexer, tabsize=4, stripnl=False)
+
+
+def test_eviction():
+    pool = LexerPool(maxsize=2)
+    python = pool.get(PythonLexer)
+    pool.get(CLexer)
+    # python is the most recently used one, C is evicted
+    assert pool.get(PythonLexer) is python
+    pool.get(PythonLexer, stripnl=False)
+    assert len(pool) == 2
+    assert pool.get(PythonLexer) is python
+    pool.clear()
+    assert len(pool) == 0
@@ -0,0 +1,94 @@
+from pygments.lexers import PythonLexer
+from pygments.styles import get_style_by_name
+from pygments.token import Token
+
+from ch2.plan import build_plan, locate, utf16_len
+from ch2.styletable import get_table
+
+
+def covered(plan):
+    '''Check that spans are contiguous from 0 and return the covered length.'''
+
+    pos = 0
+    for start, length, _ in plan.spans:
+        assert start == pos
+        assert length > 0
+        pos += length
+    return pos
+
+
+def test_utf16_len():
+    assert utf16_len("abc") == 3
+    assert utf16_len("é") == 1
+    assert utf16_len("😀") == 2
+    assert utf16_len("a😀b𝔸") == 6
+
+
+def test_astral_coverage():
+    code = 's = "😀 𝔸"  # 🎉\nt = 1\n'
+    table = get_table(get_style_by_name('default'))
+    tokens = list(PythonLexer(stripnl=False).get_tokens(code))
+    # Writer cursors move by code point
+    plan = build_plan(tokens, table.resolve, wskey=table.wskeys.get)
+    assert covered(plan) == len(code.rstrip())
+    # EditEngine cursors move by UTF-16 code unit
+    plan16 = build_plan(tokens, table.resolve, wskey=table.wskeys.get, utf16=True)
+    assert covered(plan16) == utf16_len(code.rstrip())
+    assert [p for _, _, p in plan.spans] == [p for _, _, p in plan16.spans]
+    # spans after the astral characters are shifted by one unit per character
+    assert plan16.spans[-1][0] - plan.spans[-1][0] == 3
+
+
+def test_coalescing():
+    tokens = [(Token.Keyword, "def"), (Token.Keyword.Declaration, "class"), (Token.Name, "x")]
+    resolve = {Token.Keyword: 'kw', Token.Keyword.Declaration: 'kw', Token.Name: 'name'}.get
+    plan = build_plan(tokens, resolve)
+    assert plan.spans == [(0, 8, 0), (8, 1, 1)]
+    assert plan.props == ['kw', 'name']
+
+
+def test_whitespace_coalescing():
+    tokens = [(Token.Name, "a"), (Token.Text, "  "), (Token.Name, "bcd"), (Token.Text, " "), (Token.Operator, "+")]
+    resolve = {Token.Name: 'name', Token.Text: 'text', Token.Operator: 'op'}.get
+    # whitespace joins its longest neighbour with the same visible part
+    plan = build_plan(tokens, resolve, wskey=lambda props: None)
+    assert list(plan) == [(0, 7, 'name'), (7, 1, 'op')]
+    # without wskey, whitespace keeps its own properties
+    plan = build_plan(tokens, resolve)
+    assert list(plan) == [(0, 1, 'name'), (1, 2, 'text'), (3, 3, 'name'), (6, 1, 'text'), (7, 1, 'op')]
+    # a visible background is not extended to whitespace
+    plan = build_plan(tokens, resolve, wskey={'name': None, 'text': None, 'op': 'bg'}.get)
+    assert list(plan) == [(0, 7, 'name'), (7, 1, 'op')]
+    plan = build_plan(tokens, resolve, wskey={'name': 'bg', 'text': None, 'op': None}.get)
+    assert list(plan) == [(0, 1, 'name'), (1, 2, 'text'), (3, 3, 'name'), (6, 2, 'op')]
+
+
+def test_trailing_runs():
+    resolve = {Token.Name: 'name', Token.Text: 'text', Token.Comment: 'comment'}.get
+    # trailing whitespace is not formatted
+    plan = build_plan([(Token.Name, "a"), (Token.Text, " \n")], resolve)
+    assert plan.spans == [(0, 1, 0)]
+    # unless it is part of a run with visible text
+    plan = build_plan([(Token.Name, "a"), (Token.Comment, "#"), (Token.Comment, " \n")], resolve)
+    assert list(plan) == [(0, 1, 'name'), (1, 3, 'comment')]
+    # empty tokens are ignored
+    plan = build_plan([(Token.Name, ""), (Token.Comment, "#")], resolve)
+    assert list(plan) == [(0, 1, 'comment')]
+    assert len(build_plan([], resolve)) == 0
+
+
+def test_dominant_and_styled_spans():
+    tokens = [(Token.Name, "abc"), (Token.Operator, "+"), (Token.Name, "de"), (Token.Operator, "-")]
+    resolve = {Token.Name: 'name', Token.Operator: 'op'}.get
+    plan = build_plan(tokens, resolve)
+    assert plan.dominant() == 0
+    assert list(plan.styled_spans(skip=0)) == [(3, 1, 1), (6, 1, 1)]
+    assert build_plan([], resolve).dominant() is None
+
+
+def test_locate():
+    starts = [0, 4, 10]
+    assert locate(starts, 0) == (0, 0)
+    assert locate(starts, 3) == (0, 3)
+    assert locate(starts, 4) == (1, 0)
+    assert locate(starts, 12) == (2, 2)
@@ -0,0 +1,48 @@
+from pygments.styles import get_style_by_name
+from pygments.token import Token
+
+from ch2.styletable import get_table, to_int
+
+
+def test_to_int():
+    assert to_int("#ff0000") == 0xff0000
+    assert to_int("") == 0
+
+
+def test_table_is_cached():
+    style = get_style_by_name('default')
+    assert get_table(style) is get_table(style)
+    assert get_table(style) is not get_table(style, char_bg_color="#ffffff")
+    # the character background does not apply to character styles
+    assert get_table(style, "#ffffff", "ch2_default") is get_table(style, None, "ch2_default")
+
+
+def test_resolve_unknown_token_type():
+    style = get_style_by_name('default')
+    table = get_table(style)
+    unknown = Token.Keyword.Constant.Unheard.Of
+    assert unknown not in style._styles
+    assert table.resolve(unknown) == table.resolve(Token.Keyword.Constant)
+    # resolved once, then looked up
+    assert unknown in table.types
+    assert table.resolve(Token.Unheard) == table.resolve(Token)
+
+
+def test_direct_formatting():
+    style = get_style_by_name('default')
+    table = get_table(style, char_bg_color="#123456")
+    tok_style = style.style_for_token(Token.Keyword)
+    color, bold, italic, underline, bgcolor = table.resolve(Token.Keyword)
+    assert color == to_int(tok_style['color'])
+    assert bold == tok_style['bold']
+    assert bgcolor == 0x123456
+
+
+def test_character_styles():
+    style = get_style_by_name('default')
+    table = get_table(style, styleprefix="ch2_default")
+    props = table.resolve(Token.Keyword.Constant)
+    assert props == ("ch2_default.Keyword.Constant",)
+    assert table.ttypes[props] == Token.Keyword.Constant
+    # unknown types are formatted with the style of their closest styled parent
+    assert table.resolve(Token.Keyword.Constant.Unheard) == props